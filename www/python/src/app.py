@@ -5,16 +5,97 @@ import sys
 import os
 import traceback
 import urllib.parse
-from urllib.request import urlopen
+import http.client
 import re
 import datetime
 import time
+import base64
+import csv
+import hashlib
 import html
+import io
+import json
+import math
+import queue
+import random
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+import cache
+import textzip
 
 # Constants
 APP_NAME = "afdstats.py"
 MAX_LIMIT = 500
-WIKI_URL = "http://en.wikipedia.org/"
+# A signed, bolded vote can't be cast in fewer bytes than this
+VOTE_MIN_BYTES = 40
+# API fetching: titles and expected content bytes per request, the maxlag we
+# send, and how often and how patiently to retry lag and throttling errors
+API_MAX_TITLES = 50
+API_MAX_BYTES = 4 * 1024 * 1024
+API_MAXLAG = 5
+API_RETRIES = 4
+API_BACKOFF = 1.0
+USER_AGENT = "afdstats (https://afdstats.toolforge.org/)"
+# Idle replica connections kept per wiki by each process. Toolforge allows a
+# tool only a few connections at a time across all of its processes.
+DB_POOL_SIZE = 2
+# Replica connections a process has in use at once, across its threads (those
+# of format=events, scgiserver.py and asgi.py); more wait for one to come free
+DB_MAX_CONNECTIONS = 4
+# Idle keep-alive API connections kept per wiki by each process
+API_POOL_SIZE = 4
+# How long the shared cache (cache.py) keeps things, in seconds: page texts and
+# parsed AfDs are keyed by revision and AfD creators never change, so those
+# can stay until evicted, rendered pages are only reused briefly unless
+# rcwatcher.py is invalidating them, and searches that found nothing shorter
+# still
+PAGE_CACHE_TTL = 7 * 86400
+PARSED_CACHE_TTL = 86400
+# Bumped whenever what parseafd() returns changes, so older entries are missed
+PARSED_FORMAT = 3
+CREATOR_CACHE_TTL = 30 * 86400
+SIGNER_CACHE_TTL = 7 * 86400
+RESPONSE_CACHE_TTL = 600
+WATCHED_RESPONSE_CACHE_TTL = 86400
+NEGATIVE_CACHE_TTL = 300
+# Seconds a search may spend on the replica, API and parsing before the AfDs
+# analyzed so far are shown as a partial result
+REQUEST_BUDGET = 45
+# Background jobs for full-history analysis: where the queue lives, how long
+# finished results are kept, and how often a running job reports progress
+JOB_DIR = os.path.expanduser("~/afdstats-jobs")
+JOB_TTL = 86400
+JOB_PROGRESS_INTERVAL = 5
+# mode=estimate: AfDs sampled across the user's history, the number of time
+# spans they are spread over, and the z value of the confidence intervals
+ESTIMATE_SAMPLE = 200
+ESTIMATE_STRATA = 10
+ESTIMATE_Z = 1.96
+# Signatures are resolved through at most SIGNER_HOPS renames and user page
+# redirects, looking up SIGNER_BATCH names per query
+SIGNER_HOPS = 3
+SIGNER_BATCH = 1000
+# extract=diff and nomsonly read what the user added to this many AfDs at a
+# time, so that their voters are resolved together
+DIFF_LOOKAHEAD = 50
+# trend=: the periods votes can be grouped by, and how long after a period
+# ends its AfDs' outcomes are taken as settled and cached
+TRENDS = ["month", "quarter"]
+TREND_SETTLE = 30 * 86400
+TREND_CACHE_TTL = 30 * 86400
+# format=: the rendered page, the analysis as JSON, or the search's progress
+# as Server-Sent Events followed by the rendered page. A comment goes out on
+# an otherwise quiet event stream every EVENT_KEEPALIVE seconds so that
+# proxies don't time it out.
+FORMATS = ["html", "json", "events", "csv"]
+EVENT_KEEPALIVE = 15
+# format=csv and export.py: one row per AfD in the results table, written out
+# in chunks of about CSV_CHUNK_BYTES
+EXPORT_COLUMNS = ["page", "vote_date", "vote", "nom", "result", "match", "drv_count"]
+MATCH_NAMES = ["match", "non-match", "no consensus"]
+CSV_CHUNK_BYTES = 64 * 1024
 HTML_TEMPLATE = """<!doctype html>
 <html>
 <head>
@@ -22,6 +103,7 @@ HTML_TEMPLATE = """<!doctype html>
 <title>AfD Stats - Results</title>
 <link rel="stylesheet" type="text/css" href="/afdstats.css">
 <link rel="icon" type="image/x-icon" href="/favicon.ico">
+<script src="/progress.js" defer></script>
 <script>
 	function toggleNV(e) {{
 		var wasHidden = document.getElementById('noVote').style.display === 'none';
@@ -43,6 +125,9 @@ title="afdstats on Wikimedia GitLab">Source code</a></footer>
 </div>
 </body>
 </html>"""
+NO_USER = """User does not exist. Note that usernames are case sensitive."""
+NO_AFDS = """No AfDs found. Note that if the user's username does not appear in the
+wikitext of their signature, you may need to specify an alternate name."""
 NOT_FOUND = """<!doctype html>
 <html>
 	<head><title>404 Not Found</title></head>
@@ -53,6 +138,8 @@ NOT_FOUND = """<!doctype html>
 TRUES = ["1", "true", "yes"]
 STATS_RESULTS = ["k", "d", "sk", "sd", "m", "r", "t", "u", "nc"]
 STATS_VOTES = STATS_RESULTS[:-1]
+# Search options carried by a continuation cursor, as bits of its flags field
+CURSOR_FLAGS = ["nomsonly", "undetermined", "extractdiff", "dev", "closer"]
 RESULT_TYPES = [
 	"Keep",
 	"Delete",
@@ -65,6 +152,18 @@ RESULT_TYPES = [
 	"No Consensus",
 ]
 VOTE_TYPES = RESULT_TYPES[:-1]
+# Votes and results are coded as their index into OUTCOMES. The outcomes only
+# some venues have come last, outside the voting matrix.
+OUTCOMES = RESULT_TYPES + ["UNDETERMINED", "Not closed yet"]
+OUTCOMES += ["Rename", "Retarget", "Disambiguate", "Listify"]
+OUTCOME_CODES = {outcome: code for code, outcome in enumerate(OUTCOMES)}
+UNDETERMINED = OUTCOME_CODES["UNDETERMINED"]
+NOT_CLOSED = OUTCOME_CODES["Not closed yet"]
+# One row of the results table; vote and result are OUTCOMES codes, and drv
+# the deletion reviews the AfD was taken to, as [log date, page] pairs
+AfDRecord = namedtuple(
+	"AfDRecord", ["page", "vote", "votetime", "result", "nom", "drv"]
+)
 VOTE_MAP = {
 	"comment": None,
 	"note": None,
@@ -102,32 +201,44 @@ RESULT_MAP = {
 	"draftif": "Userfy",
 	"withdraw": "Speedy Keep",
 }
-MONTH_MAP = {
-	"01": "January",
-	"02": "February",
-	"03": "March",
-	"04": "April",
-	"05": "May",
-	"06": "June",
-	"07": "July",
-	"08": "August",
-	"09": "September",
-	"10": "October",
-	"11": "November",
-	"12": "December",
+# The vocabularies of the venues that go beyond AfD's; "no consensus" and
+# comments still come first
+CFD_VOTE_MAP = {"comment": None, "note": None, "renam": "Rename", "listif": "Listify"}
+CFD_VOTE_MAP.update(VOTE_MAP)
+CFD_RESULT_MAP = {
+	"no consensus": "No Consensus",
+	"renam": "Rename",
+	"listif": "Listify",
 }
-
-DATE_TG_PATTERN = re.compile("([A-Za-z]*) (\d{1,2}), (\d{4})")
+CFD_RESULT_MAP.update(RESULT_MAP)
+RFD_VOTE_MAP = {
+	"comment": None,
+	"note": None,
+	"retarget": "Retarget",
+	"refine": "Retarget",
+	"disambig": "Disambiguate",
+	"set index": "Disambiguate",
+}
+RFD_VOTE_MAP.update(VOTE_MAP)
+RFD_RESULT_MAP = {
+	"no consensus": "No Consensus",
+	"retarget": "Retarget",
+	"refine": "Retarget",
+	"disambig": "Disambiguate",
+	"set index": "Disambiguate",
+}
+RFD_RESULT_MAP.update(RESULT_MAP)
 DRV_PATTERN = re.compile(
 	"(?:(?:\{\{delrev xfd)|(?:\{\{delrevafd)|(?:\{\{delrevxfd))(.*?)\}\}",
 	flags=re.IGNORECASE,
 )
 DRV_DATE_PATTERN = re.compile("\|date=(\d{4} \w*? \d{1,2})", flags=re.IGNORECASE)
 DRV_NAME_PATTERN = re.compile("\|page=(.*?)(?:\||$)", flags=re.IGNORECASE)
-PAGE_LIST_PATTERN = re.compile(r"<page.*?>.*?</page>", re.DOTALL)
-PAGE_NAME_PATTERN = re.compile(r"<page.*?title=\"(.*?)\"")
-PAGE_TEXT_PATTERN = re.compile(r'<rev.*?xml:space="preserve">(.*?)</rev>', re.DOTALL)
-PAGE_REDIRECT_PATTERN = re.compile('<page.*?redirect="".*?>')
+DIFF_ADDED_PATTERN = re.compile(
+	r'<td class="diff-addedline[^"]*"><div>(.*?)</div></td>', re.DOTALL
+)
+HTML_TAG_PATTERN = re.compile(r"<[^>]*>")
+JOB_ID_PATTERN = re.compile(r"[0-9a-f]{16}")
 RESULT_PATTERN = re.compile(
 	"The result (?:of the debate )?was(?:.*?\n?.*?)(?:'{3}?)(.*?)(?:'{3}?)",
 	flags=re.IGNORECASE,
@@ -146,6 +257,144 @@ VOTE_PATTERN = re.compile(
 VOTER_MATCH_PATTERN = re.compile(
 	"\[\[User.*?:(.*?)(?:\||(?:\]\]))", flags=re.IGNORECASE
 )
+RENAME_PARAMS_PATTERN = re.compile(r'"5::newuser";s:\d+:"(.*?)";')
+LOG_HEADING_PATTERN = re.compile(r"^====(?!=)\s*(.*?)\s*(?<!=)====\s*$", re.MULTILINE)
+XFD_RESULT_PATTERN = re.compile(
+	"The result of the (?:debate|discussion) was(?:.*?\n?.*?)(?:'{3}?)(.*?)(?:'{3}?)",
+	flags=re.IGNORECASE,
+)
+
+# A deletion venue: the prefix of its discussions' titles in the project
+# namespace and of the log pages among them to leave out, whether each title
+# is instead a daily log with one discussion per ==== section, its vote and
+# result vocabularies, and how its closes are worded
+Venue = namedtuple(
+	"Venue",
+	[
+		"name",
+		"prefix",
+		"log",
+		"daily",
+		"votemap",
+		"resultmap",
+		"resultpattern",
+		"archived",
+	],
+)
+AFD_ARCHIVED = [
+	"The following discussion is an archived debate of the proposed deletion of the article below",
+	"This page is an archive of the proposed deletion of the article below.",
+	"'''This page is no longer live.'''",
+]
+XFD_ARCHIVED = ["is an archived debate", "is an archived discussion"]
+VENUES = {
+	"afd": Venue(
+		"AfD",
+		"Articles_for_deletion/",
+		"Articles_for_deletion/Log/",
+		False,
+		VOTE_MAP,
+		RESULT_MAP,
+		RESULT_PATTERN,
+		AFD_ARCHIVED,
+	),
+	"mfd": Venue(
+		"MfD",
+		"Miscellany_for_deletion/",
+		"Miscellany_for_deletion/Archived_debates/",
+		False,
+		VOTE_MAP,
+		RESULT_MAP,
+		XFD_RESULT_PATTERN,
+		XFD_ARCHIVED,
+	),
+	"tfd": Venue(
+		"TfD",
+		"Templates_for_discussion/Log/",
+		None,
+		True,
+		VOTE_MAP,
+		RESULT_MAP,
+		XFD_RESULT_PATTERN,
+		XFD_ARCHIVED,
+	),
+	"cfd": Venue(
+		"CfD",
+		"Categories_for_discussion/Log/",
+		None,
+		True,
+		CFD_VOTE_MAP,
+		CFD_RESULT_MAP,
+		XFD_RESULT_PATTERN,
+		XFD_ARCHIVED,
+	),
+	"rfd": Venue(
+		"RfD",
+		"Redirects_for_discussion/Log/",
+		None,
+		True,
+		RFD_VOTE_MAP,
+		RFD_RESULT_MAP,
+		XFD_RESULT_PATTERN,
+		XFD_ARCHIVED,
+	),
+	"ffd": Venue(
+		"FfD",
+		"Files_for_discussion/2",  # the daily pages, not the project's others
+		None,
+		True,
+		VOTE_MAP,
+		RESULT_MAP,
+		XFD_RESULT_PATTERN,
+		XFD_ARCHIVED,
+	),
+}
+SIMPLE_VENUES = {
+	"rfd": Venue(
+		"RfD",
+		"Requests_for_deletion/Requests/",
+		None,
+		False,
+		VOTE_MAP,
+		RESULT_MAP,
+		XFD_RESULT_PATTERN,
+		XFD_ARCHIVED,
+	),
+}
+
+# The wikis that can be searched with wiki=: the replica database and host,
+# where pages and the API are, and the deletion venues with their local
+# vocabularies, the first of which is searched by default. Their project
+# namespaces must be called "Wikipedia".
+Wiki = namedtuple("Wiki", ["name", "dbname", "host", "url", "api", "venues"])
+WIKIS = {
+	"enwiki": Wiki(
+		"enwiki",
+		"enwiki_p",
+		"enwiki.web.db.svc.wikimedia.cloud",
+		"http://en.wikipedia.org/",
+		"https://en.wikipedia.org/w/api.php",
+		VENUES,
+	),
+	"simplewiki": Wiki(
+		"simplewiki",
+		"simplewiki_p",
+		"simplewiki.web.db.svc.wikimedia.cloud",
+		"http://simple.wikipedia.org/",
+		"https://simple.wikipedia.org/w/api.php",
+		SIMPLE_VENUES,
+	),
+}
+DEFAULT_WIKI = WIKIS["enwiki"]
+# Per-wiki pools of replica and keep-alive API connections, which threads
+# take connections from and hand them back to; both are opened the first time
+# a wiki is used
+dbpools = {}
+apipools = {}
+dbslots = threading.BoundedSemaphore(DB_MAX_CONNECTIONS)
+# Statements this process has sent to the replicas, which warmer.py paces by
+dbqueries = [0]
+
 
 # TODO: Provide link to usersearch.py that will show all
 # AfD edits during the time period that this search covers
@@ -158,16 +407,6 @@ def app(environ, start_response):
 		start_response("404 Not Found", [("Content-Type", "text/html")])
 		return [NOT_FOUND.encode("utf-8")]
 
-	# initialize variables
-	matchstats = [0, 0, 0]  # matches, non-matches, no consensus
-	stats = {}
-	votetypes = VOTE_TYPES.copy()
-	for v in STATS_VOTES:
-		for r in STATS_RESULTS:
-			stats[v + r] = 0
-	for v in votetypes:
-		stats[v] = 0
-
 	output = []
 
 	try:
@@ -175,235 +414,709 @@ def app(environ, start_response):
 
 		##################Validate input
 		form = urllib.parse.parse_qs(environ.get("QUERY_STRING", ""))
-		username = (
-			urllib.parse.unquote_plus(form.get("name", [""])[0])
-			.replace("_", " ")
-			.strip()
-		)
-		if username == "":
+		if "jobid" in form:
+			return jobpage(start_response, output, form["jobid"][0])
+		if "page" in form:
+			return participantspage(start_response, output, form, starttime)
+		search = parsesearch(form)
+		if search is None:
 			return errorout(
 				start_response,
 				output,
 				f"No username entered.<!--{environ.get('QUERY_STRING', '')}-->",
 			)
-		username = username[0].capitalize() + username[1:]
-		altusername = (
-			urllib.parse.unquote_plus(form.get("altname", [""])[0])
-			.replace("_", " ")
-			.strip()
-		)
-		startdate = str(form.get("startdate", [""])[0])
-		nomsonly = form.get("nomsonly", [""])[0].lower() in TRUES
-		dev = form.get("dev", [""])[0].lower() in TRUES
-		undetermined = form.get("undetermined", [""])[0].lower() in TRUES
-		if undetermined is True:
-			votetypes.append("UNDETERMINED")
-			stats["UNDETERMINED"] = 0
-		try:
-			maxsearch = min(MAX_LIMIT, int(form["max"][0]))
-		except Exception:
-			maxsearch = 200
-
-		startdatestr = ""
-		try:
-			if (
-				len(startdate) == 8
-				and int(startdate) > 20000000
-				and int(startdate) < 20300000
-			):
-				startdatestr = f"AND rev_timestamp<={startdate}235959"
-		except Exception:
-			pass
-
-		results = queryDB(startdatestr, nomsonly, username)
-
-		output.append(f"<h1>AfD Statistics for User:{html.escape(username)}</h1>")
+		if search["job"] is True:
+			job = submitjob(search)
+			return jobpage(start_response, output, job["id"])
+		if search["format"] == "events":
+			return eventstream(start_response, search, starttime)
+		if search["format"] == "csv":
+			return csvexport(start_response, search, starttime)
+		if search["format"] == "json":
+			analysis = analyze(search, starttime + REQUEST_BUDGET)
+			if isinstance(analysis, str):
+				start_response(
+					"500 Internal Server Error", [("Content-Type", "application/json")]
+				)
+				return [json.dumps({"error": analysis}).encode("utf-8")]
+			start_response("200 OK", [("Content-Type", "application/json")])
+			return [json.dumps(analysis).encode("utf-8")]
 
-		if len(results) == 0:
-			return errorout(
-				start_response,
-				output,
-				"""No AfDs found. This user may not exist. Note that if the user's
-username does not appear in the wikitext of their signature, you may need to specify an
-alternate name.""",
+		output.append(
+			"<h1>{} Statistics for User:{}</h1>".format(
+				venuelabel(search), html.escape(search["username"])
 			)
+		)
+
+		rendered = getresponse(search)
+		if rendered is not None:
+			output.append(rendered)
+		else:
+			analysis = analyze(search, starttime + REQUEST_BUDGET)
+			if isinstance(analysis, str):
+				return errorout(start_response, output, analysis)
+			body = []
+			render(analysis, body)
+			output.extend(body)
+			if analysis["partial"] is False and search["dev"] is False:
+				putresponse(search, analysis, "\n".join(body))
 
 		output.append(
-			"""<p>These statistics were compiled by an automated process, and may
-contain errors or omissions due to the wide variety of styles with which people cast
-votes at AfD. Any result fields which contain "UNDETERMINED" were not able to be parsed,
-and should be examined manually.</p>
-<h2>Vote totals</h2>"""
+			f"<small>Elapsed time: {(time.time() - starttime):.2f} seconds.</small><br>"
 		)
+		start_response("200 OK", [("Content-Type", "text/html")])
+		return [HTML_TEMPLATE.format("\n".join(output)).encode("utf-8")]
 
-		startdatestr = ""
-		if startdate:
-			datestr = datetime.datetime.strptime(startdate, "%Y%m%d")
-			startdatestr = f" (from {datestr:'%b %d %Y'} and earlier)"
-		output.append(
-			"Total number of unique AfD pages edited by {}{}: {}<br>".format(
-				username, startdatestr, len(results)
-			)
+	except SystemExit:
+		sys.exit(0)
+	except Exception as err:
+		return errorout(
+			start_response,
+			output,
+			f"""{html.escape(str(err))}<br>
+{html.escape(traceback.format_exc())}<br>
+Fatal error.""",
 		)
 
-		if len(results) > maxsearch:
-			output.append(f"Only the last {maxsearch} AfD pages were analyzed.<br>")
 
-		##################Analyze results
-		pages = results[: min(maxsearch, len(results))]
-		if len(pages) <= 50:
-			alldata = APIpagedata(pages)
-			if isinstance(alldata, str):
-				return errorout(start_response, output, alldata)
-		else:
-			alldata = {}
-			for i in range(0, len(pages), 50):
-				newdata = APIpagedata(pages[i : min(i + 50, len(pages))])
-				if isinstance(newdata, str):
-					return errorout(start_response, output, newdata)
-				alldata = alldata | newdata
+def parsesearch(form):
+	# Turns the query string into the options of a search, or None if no
+	# username was given. The result is plain JSON so it can be queued.
+	username = (
+		urllib.parse.unquote_plus(form.get("name", [""])[0]).replace("_", " ").strip()
+	)
+	if username == "":
+		return None
+	username = username[0].capitalize() + username[1:]
+	altusername = (
+		urllib.parse.unquote_plus(form.get("altname", [""])[0])
+		.replace("_", " ")
+		.strip()
+	)
+	startdate = str(form.get("startdate", [""])[0])
+	try:
+		if not (
+			len(startdate) == 8
+			and int(startdate) > 20000000
+			and int(startdate) < 20300000
+		):
+			startdate = ""
+	except Exception:
+		startdate = ""
+	try:
+		maxsearch = min(MAX_LIMIT, int(form["max"][0]))
+	except Exception:
+		maxsearch = 200
+	search = {
+		"username": username,
+		"altusername": altusername,
+		"startdate": startdate,
+		"after": None,
+		"maxsearch": maxsearch,
+		"nomsonly": form.get("nomsonly", [""])[0].lower() in TRUES,
+		"dev": form.get("dev", [""])[0].lower() in TRUES,
+		"extractdiff": form.get("extract", [""])[0].lower() == "diff",
+		"undetermined": form.get("undetermined", [""])[0].lower() in TRUES,
+		"job": form.get("job", [""])[0].lower() in TRUES,
+		"estimate": form.get("mode", [""])[0].lower() == "estimate",
+		"closer": form.get("role", [""])[0].lower() == "closer",
+		"trend": form.get("trend", [""])[0].lower(),
+		"format": form.get("format", [""])[0].lower(),
+		"wiki": form.get("wiki", [DEFAULT_WIKI.name])[0].lower(),
+		"venue": form.get("venue", [""])[0].lower(),
+	}
+	if search["wiki"] not in WIKIS:
+		search["wiki"] = DEFAULT_WIKI.name
+	venues = WIKIS[search["wiki"]].venues
+	if search["venue"] not in venues and search["venue"] != "all":
+		search["venue"] = next(iter(venues))
+	if search["format"] not in FORMATS:
+		search["format"] = "html"
+	# Closes have no votes to estimate a match rate from, or to trend
+	search["estimate"] = search["estimate"] and not search["closer"]
+	if search["trend"] not in TRENDS or search["closer"] is True:
+		search["trend"] = None
+	# A continuation cursor carries its own position and options
+	cursor = decodecursor(form.get("cont", [""])[0])
+	if cursor is not None:
+		search.update(cursor, startdate="")
+	return search
 
-		tablelist = []
-		novotes = 0
 
-		output.append(
-			"""<small><a id href="javascript:void(0);" onClick="toggleNV(this)">
-Show pages without detected votes</a></small>
-<ul id="noVote" style="display: none">"""
+def encodecursor(search, position):
+	# Compact, opaque token for "the next AfDs after this (rev_timestamp,
+	# page_id) position", along with the options of the search
+	flags = sum(1 << i for i, flag in enumerate(CURSOR_FLAGS) if search[flag])
+	# Jobs (a maxsearch of None) are continued as jobs, whatever this says
+	raw = "{}.{}.{}.{}.{}".format(
+		position[0],
+		position[1],
+		search["maxsearch"] or MAX_LIMIT,
+		flags,
+		search["altusername"],
+	)
+	return base64.urlsafe_b64encode(raw.encode("utf-8")).decode().rstrip("=")
+
+
+def decodecursor(token):
+	try:
+		raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode("utf-8")
+		timestamp, pageid, maxsearch, flags, altusername = raw.split(".", 4)
+		if not (len(timestamp) == 14 and timestamp.isdigit()):
+			return None
+		cursor = {
+			"after": [timestamp, int(pageid)],
+			"maxsearch": min(MAX_LIMIT, max(1, int(maxsearch))),
+			"altusername": altusername,
+		}
+		for i, flag in enumerate(CURSOR_FLAGS):
+			cursor[flag] = bool(int(flags) & (1 << i))
+		return cursor
+	except Exception:
+		return None
+
+
+def analyze(search, deadline=None, progress=None):
+	# Runs a search: queries the replica, fetches and parses the AfDs and
+	# tallies the user's votes. Returns the analysis as a JSON-able dict, or an
+	# error string. A maxsearch of None analyzes the user's whole history, and
+	# progress, if given, is called with an event dict as each stage of the
+	# search goes by: "query" once the AfDs are known, "fetch" after every
+	# batch of page texts and "page" with running totals after every page.
+	username = search["username"]
+	altusername = search["altusername"]
+	nomsonly = search["nomsonly"]
+	dev = search["dev"]
+	extractdiff = search["extractdiff"]
+	undetermined = search["undetermined"]
+	closer = search["closer"]
+
+	# Votes per OUTCOMES code, and the vote/result matrix as a flat array
+	votecounts = [0] * len(OUTCOMES)
+	matrix = [0] * (len(VOTE_TYPES) * len(RESULT_TYPES))
+	# With role=closer: closes per result code, and per "YYYY-MM"
+	closecounts = [0] * len(OUTCOMES)
+	months = {}
+
+	startdatestr = ""
+	if search["startdate"]:
+		startdatestr = f"AND rev.rev_timestamp<={search['startdate']}235959"
+
+	after = search["after"]
+	wiki = WIKIS[search["wiki"]]
+	venues = searchvenues(search)
+	if not venues:
+		return "Nominations and closes can only be listed for AfD and MfD."
+	cachekey = [username, startdatestr, after, nomsonly, closer, search["venue"]]
+	errorstr = negcacheget(cachekey, wiki)
+	if errorstr is not None:
+		return errorstr
+
+	results = queryDB(
+		startdatestr, nomsonly, username, after, deadline, closer, venues, wiki
+	)
+
+	if results is None or len(results) == 0:
+		errorstr = NO_USER if results is None else NO_AFDS
+		negcacheset(cachekey, errorstr, wiki)
+		return errorstr
+
+	##################Analyze results
+	if search["estimate"] is True:
+		pages = stratifiedsample(results, ESTIMATE_SAMPLE, random.Random(username))
+	elif search["maxsearch"] is None:
+		pages = results
+	else:
+		pages = results[: min(search["maxsearch"], len(results))]
+	pages = firstcreators(pages, deadline, wiki)
+	devlog = []
+	if progress is not None:
+		progress({"stage": "query", "rows": len(results), "total": len(pages)})
+
+	# trend=: votes per month or quarter of the user's first edit to each AfD.
+	# The outcome of every AfD in a settled period is cached with the period,
+	# along with the AfD's revision, so a refresh only needs to analyze the
+	# recent ones and those edited since.
+	trend = search["trend"]
+	trends = {}
+	periodpages = {}
+	replay = {}
+	trendcache = trend is not None and search["estimate"] is False
+	if trendcache is True:
+		latest = {e[0].decode(): int(e[8]) for e in pages}
+		for period in {trendperiod(e[2], trend) for e in pages}:
+			if periodsettled(period):
+				hit = cache.get(wikins(wiki, "trend"), trendkey(search, period))
+				for page, outcome in json.loads(hit or "{}").items():
+					if len(outcome) == 3 and outcome[2] == latest.get(page):
+						replay[page] = outcome[:2]
+		if dev is True:
+			devlog.append(f"{len(replay)} pages were in cached trend periods")
+
+	# Skip the text download for pages the user demonstrably didn't vote on
+	fetchpages = []
+	skipped = set()
+	for entry in pages:
+		if entry[0].decode() in replay:
+			continue
+		if needsfetch(entry, username, altusername):
+			fetchpages.append(entry)
+		else:
+			skipped.add(entry[0].decode())
+	if dev is True:
+		devlog.append(
+			"Prefilter skipped {} of {} pages ({} bytes not fetched)".format(
+				len(skipped),
+				len(pages),
+				sum(int(e[4] or 0) for e in pages if e[0].decode() in skipped),
+			)
 		)
 
-		for entry in pages:
-			try:
-				page = entry[0].decode()
+	# Closes, nominations and diff mode only need the page head for the close
+	# result and DRV notices; any votes are read from the text the user added,
+	# which for a nomination is the page's creation. Daily logs need the full
+	# text, as their closes are further down.
+	headonly = extractdiff is True or closer is True or nomsonly is True
+	headonly = headonly and not any(venue.daily for venue in venues)
+	section = 0 if headonly is True else None
+	# AfDs already parsed at their current revision need no text at all
+	parsed = {}
+	for entry in fetchpages:
+		key = parsedkey(entry[0].decode(), section, int(entry[8]))
+		hit = cache.get(wikins(wiki, "parsed"), key)
+		if hit is not None:
+			parsed[entry[0].decode()] = json.loads(hit)
+	fetchpages = [e for e in fetchpages if e[0].decode() not in parsed]
+	if dev is True:
+		devlog.append(f"{len(parsed)} pages were parsed already")
+	# Signatures that link to a former name of the user, or to a user page
+	# that redirects to theirs, count as the user's. Voters are resolved a
+	# batch of pages at a time, starting with the pages parsed already.
+	voters = participantnames(parsed.items(), wiki)
+	signers, resolved = trysigners(voters, deadline, wiki)
+	partial = not resolved
+	revids = {e[0].decode(): int(e[8]) for e in fetchpages}
+	names = (username.lower(), altusername.lower())
+	fetchstats = [0, 0]  # API requests, bytes downloaded
+	batches = APIpagedata(fetchpages, section, fetchstats, deadline, wiki)
+	alldata = {}
+	requested = set()
 
-				# "data" means the full page text
-				raw_data = alldata["Wikipedia:" + page.replace("_", " ")]
-				data = html.unescape(raw_data.replace("\n", "\\n")).replace("\\n", "\n")
-				data = STRIKE_PATTERN.sub("", data)
-
-				# We don't want to include the closing statement while finding votes
-				header_index = data.find("==")
-				if header_index > -1:
-					votes_data = data[header_index:]
-				else:
-					votes_data = data
-				votes = VOTE_PATTERN.findall(votes_data)
-				result_data = data[: max(header_index, data.find("(UTC)"))]
-				result = findresults(result_data)
-				dupvotes = []
-				deletionreviews = findDRV(data[:header_index], page)
-
-				def find_user_idx(vote):
-					possible_min_user_idx = vote.rfind("[[User")
-					return (
-						possible_min_user_idx
-						if possible_min_user_idx >= 0
-						else vote.rfind("[[user")
-					)
+	tablelist = []
+	novotelist = []
+	processed = 0
+	matchstats = [0, 0, 0]  # as in render(), for progress events only
+	added = {}  # extract=diff: votes in the text the user added, by page
 
-				def find_voter_match(vote):
-					return VOTER_MATCH_PATTERN.match(vote[find_user_idx(vote) :])
+	for index, entry in enumerate(pages):
+		page = entry[0].decode()
+		# Out of time (or the API gave up on us): keep what we have
+		if deadline is not None and time.time() >= deadline:
+			partial = True
+			break
+		if (
+			page not in skipped
+			and page not in parsed
+			and page not in requested
+			and page not in replay
+		):
+			try:
+				batch, newdata = next(batches)
+			except Exception as err:
+				if processed == 0:
+					return f"Unable to fetch page data. Please try again.<!--{err}-->"
+				partial = True
+				break
+			requested.update(batch)
+			alldata.update(newdata)
+			# The batch is parsed here so its voters can be resolved together;
+			# pages that fail are left to fail again, and be logged, below
+			fresh = {}
+			for name in batch:
+				data = alldata.get("Wikipedia:" + name.replace("_", " "))
+				if name in parsed or data is None:
+					continue
+				try:
+					fresh[name] = parseafd(data, name, headonly, wiki)
+				except Exception:
+					continue
+				cacheparsed(name, section, revids[name], fresh[name], wiki)
+			parsed.update(fresh)
+			voters = participantnames(fresh.items(), wiki) - signers.keys()
+			more, resolved = trysigners(voters, deadline, wiki)
+			signers.update(more)
+			partial = partial or not resolved
+			if progress is not None:
+				progress(
+					{
+						"stage": "fetch",
+						"pages": len(batch),
+						"requests": fetchstats[0],
+						"bytes": fetchstats[1],
+					}
+				)
+		processed += 1
+		ntable, nnovote = len(tablelist), len(novotelist)
+		try:
+			if page in replay:
+				records, novotes = replay[page]
+				for record in records:
+					tablelist.append(AfDRecord(*record))
+					updatestats(votecounts, matrix, tablelist[-1])
+				novotelist.extend(tuple(item) for item in novotes)
+				continue
+			if page in skipped:
+				novotelist.append((page, ""))
+				continue
 
-				firsteditor = (
-					entry[1].decode(),
-					datetime.datetime.strptime(
-						entry[2].decode(), "%Y%m%d%H%M%S"
-					).strftime("%B %d, %Y"),
+			if page not in parsed:
+				# "data" means the full page text
+				data = alldata["Wikipedia:" + page.replace("_", " ")]
+				parsed[page] = parseafd(data, page, headonly, wiki)
+				cacheparsed(page, section, int(entry[8]), parsed[page], wiki)
+			venue = venueof(page, wiki)
+			if venue.daily is True:
+				# Nominations are the first signed comment in each section
+				discussions = [
+					[f"{page}#{d[0]}", d[1], d[2], *d[3:]] for d in parsed[page]
+				]
+			else:
+				firstedit = datetime.datetime.strptime(
+					entry[2].decode(), "%Y%m%d%H%M%S"
 				)
+				discussions = [
+					[page, entry[1].decode(), firstedit.strftime("%B %d, %Y")]
+					+ parsed[page]
+				]
+			for discussion in discussions:
+				name, nominator, nomtime = discussion[:3]
+				result_data, result, deletionreviews, participants = discussion[3:]
+				if closer is True:
+					# Only count the close if it was signed by this user
+					signer = findsigner(result_data)
+					signer = "" if signer is None else signer.group(1).strip()
+					signer = signer.replace("_", " ")
+					if signer == "" or signer.lower() not in (
+						username.lower(),
+						altusername.lower(),
+					):
+						novotelist.append(
+							(name, f" (closer: {signer})" if signer else "")
+						)
+						continue
+					closetime = datetime.datetime.strptime(
+						entry[2].decode(), "%Y%m%d%H%M%S"
+					)
+					tablelist.append(
+						AfDRecord(
+							name,
+							None,
+							closetime.strftime("%B %d, %Y"),
+							result,
+							0,
+							deletionreviews,
+						)
+					)
+					closecounts[result] += 1
+					month = closetime.strftime("%Y-%m")
+					months[month] = months.get(month, 0) + 1
+					continue
+				if (extractdiff is True or nomsonly is True) and venue.daily is False:
+					if page not in added:
+						ahead = pages[index : index + DIFF_LOOKAHEAD]
+						done = skipped | replay.keys() | added.keys()
+						added.update(
+							addedvotesahead(ahead, done, fetchstats, deadline, wiki)
+						)
+						voters = {p[0] for v in added.values() for p in v}
+						voters -= signers.keys()
+						more, resolved = trysigners(voters, deadline, wiki)
+						signers.update(more)
+						partial = partial or not resolved
+					participants = added.pop(page)
+				dupvotes = []
 				is_nominator = False
-				if (firsteditor[0].lower() == username.lower()) or (
-					firsteditor[0].lower() == altusername.lower()
+				if nominator != "" and (
+					(nominator.lower() == username.lower())
+					or (nominator.lower() == altusername.lower())
 				):
 					is_nominator = True
 
-				for vote in votes:
-					try:
-						votermatch = find_voter_match(vote)
-						if votermatch is None:
-							continue
-						voter = votermatch.group(1).strip()
-
-						# Sometimes, a "#top" will sneak in, so remove it
-						if voter.endswith("#top"):
-							voter = voter[:-4]
-						if dev is True:
-							output.append(f"<pre>{page}, {voter}, {vote}</pre>")
-
-						# Underscores are turned into spaces by MediaWiki
-						voter = voter.replace("_", " ")
-
-						# Check if vote was made by the user we're counting votes for
-						if (
-							voter.lower() == username.lower()
-							or voter.lower() == altusername.lower()
-						):
-							votetype = parsevote(vote[3 : vote.find("'", 3)])
-							if votetype is None:
-								continue
-							if (votetype == "UNDETERMINED") and (
-								(undetermined is False) or (is_nominator is True)
-							):
-								continue
-							timematch = TIME_MATCH_PATTERN.search(vote)
-							if timematch is None:
-								votetime = ""
-							else:
-								votetime = parsetime(timematch.group(1))
-							dupvotes.append(
-								(page, votetype, votetime, result, 0, deletionreviews)
-							)
-					except Exception as err:
-						if dev is True:
-							output.append(f"<br>ERROR: {str(err)}<br>")
-							output.append(html.escape(traceback.format_exc()))
+				for voter, votetype, votetime in participants:
+					if dev is True:
+						devlog.append(f"{name}, {voter}, {OUTCOMES[votetype]}")
+					# Check if vote was made by the user we're counting votes for
+					signer = signers.get(voter, voter)
+					if voter.lower() not in names and signer.lower() not in names:
+						continue
+					if (votetype == UNDETERMINED) and (
+						(undetermined is False) or (is_nominator is True)
+					):
 						continue
+					dupvotes.append(
+						AfDRecord(name, votetype, votetime, result, 0, deletionreviews)
+					)
 				if len(dupvotes) < 1:
 					if is_nominator:  # user is nominator
-						tablelist.append(
-							(page, "Delete", firsteditor[1], result, 1, deletionreviews)
+						record = AfDRecord(
+							name,
+							OUTCOME_CODES["Delete"],
+							nomtime,
+							result,
+							1,
+							deletionreviews,
 						)
-						updatestats(stats, "Delete", result)
-					else:
-						closermatch = find_voter_match(result_data) or ""
+						tablelist.append(record)
+						updatestats(votecounts, matrix, record)
+					elif venue.daily is False:
+						closermatch = findsigner(result_data) or ""
 						if isinstance(closermatch, re.Match):
 							closermatch = f" (closer: {closermatch.group(1).strip()})"
 
-						output.append(
-							"<li><a href = '{}wiki/Wikipedia:{}'>{}</a>{}</li>".format(
-								WIKI_URL, urllib.parse.quote(page), page, closermatch
-							)
-						)
-						novotes += 1
+						novotelist.append((page, closermatch))
 				elif len(dupvotes) > 1:
 					ch = len(dupvotes) - 1
 					tablelist.append(dupvotes[ch])
-					updatestats(stats, dupvotes[ch][1], dupvotes[ch][3])
+					updatestats(votecounts, matrix, dupvotes[ch])
 				else:
 					tablelist.append(dupvotes[0])
-					updatestats(stats, dupvotes[0][1], dupvotes[0][3])
-			except Exception as err:
-				if dev is True:
-					output.append(f"<br>ERROR: {str(err)}<br>")
-					output.append(html.escape(traceback.format_exc()))
-				continue
-		output.append("</ul>")
-		##################Print results tables
-		totalvotes = 0
-		for i in votetypes:
-			totalvotes += stats[i]
-		if totalvotes > 0:
-			output.append("<ul>")
-			for i in votetypes:
-				output.append(
-					f"<li>{i} votes: {stats[i]} ({(stats[i] / totalvotes):.1%})</li>"
+					updatestats(votecounts, matrix, dupvotes[0])
+			# Only the discussions of a daily log that the user took part in
+			# are listed, so the log is listed on its own if there were none
+			if venue.daily is True and len(tablelist) == ntable:
+				novotelist.append((page, ""))
+		except Exception as err:
+			if dev is True:
+				devlog.append(f"ERROR: {str(err)}\n{traceback.format_exc()}")
+			continue
+		finally:
+			if trend is not None:
+				period = trendperiod(entry[2], trend)
+				updatetrend(
+					trends.setdefault(period, newtrendbucket()),
+					periodpages.setdefault(period, {}),
+					page,
+					int(entry[8]),
+					tablelist[ntable:],
+					novotelist[nnovote:],
 				)
-			output.append("</ul>")
-			if novotes:
-				output.append(
-					f"The remaining {novotes} pages had no discernible vote by this user."
+			if progress is not None:
+				for record in tablelist[ntable:]:
+					if record.vote is None:  # closes
+						continue
+					match = MATCH_CLASSES[record.vote * len(OUTCOMES) + record.result]
+					if match is not None:
+						matchstats[match] += 1
+				progress(
+					{
+						"stage": "page",
+						"processed": processed,
+						"total": len(pages),
+						"votes": len(tablelist),
+						"novotes": len(novotelist),
+						"matchstats": list(matchstats),
+					}
 				)
+	if trendcache is True:
+		# Rows not analyzed were last edited, so first edited, no later than
+		# the last one analyzed; periods starting after that are complete
+		if processed == len(results):
+			bound = ""
+		else:
+			bound = pages[processed - 1][6].decode() if processed else "99999999999999"
+		for period, outcomes in periodpages.items():
+			if (
+				periodsettled(period)
+				and periodbounds(period)[0] > bound
+				and None not in outcomes.values()
+				and not all(page in replay for page in outcomes)
+			):
+				value = json.dumps(outcomes).encode("utf-8")
+				key = trendkey(search, period)
+				cache.put(wikins(wiki, "trend"), key, value, TREND_CACHE_TTL)
+	if dev is True:
+		devlog.append(
+			"Fetched {} bytes in {} API requests ({} extraction)".format(
+				fetchstats[1],
+				fetchstats[0],
+				"diff"
+				if extractdiff is True
+				else "page head"
+				if headonly is True
+				else "full page",
+			)
+		)
+		devlog.append(f"Cache ({cache.backend()}): {cache.stats()}")
+		devlog.append(
+			"{} of {} signatures resolved to another account".format(
+				sum(1 for name, signer in signers.items() if name != signer),
+				len(signers),
+			)
+		)
+
+	# Where a continuation should resume: just after the last AfD we got to
+	resume = after
+	if processed > 0:
+		resume = [pages[processed - 1][6].decode(), int(pages[processed - 1][7])]
+	# The revision each AfD was analyzed at, to tell when a result is stale
+	revisions = {e[0].decode(): int(e[8]) for e in pages[:processed]}
+	return {
+		"search": search,
+		"total": len(results),
+		"analyzed": len(pages),
+		"processed": processed,
+		"partial": partial,
+		"resume": resume,
+		"revisions": revisions,
+		"fetchstats": fetchstats,
+		"tablelist": tablelist,
+		"novotelist": novotelist,
+		"votecounts": votecounts,
+		"matrix": matrix,
+		"closecounts": closecounts,
+		"months": months,
+		"trends": [dict(trends[p], period=p) for p in sorted(trends)],
+		"devlog": devlog,
+	}
+
+
+def render(analysis, output):
+	# Prints the results of analyze() below the page heading
+	search = analysis["search"]
+	username = search["username"]
+	maxsearch = search["maxsearch"]
+	wiki = WIKIS[search["wiki"]]
+	# Records come back from a job's JSON as plain lists
+	tablelist = [AfDRecord(*i) for i in analysis["tablelist"]]
+	votecounts = analysis["votecounts"]
+	matrix = analysis["matrix"]
+	matchstats = [0, 0, 0]  # matches, non-matches, no consensus
+	votetypes = list(range(len(VOTE_TYPES)))
+	if search["undetermined"] is True:
+		votetypes.append(UNDETERMINED)
+	votetypes += [i for i in range(NOT_CLOSED + 1, len(OUTCOMES)) if votecounts[i]]
+
+	output.append(
+		"""<p>These statistics were compiled by an automated process, and may
+contain errors or omissions due to the wide variety of styles with which people cast
+votes at AfD. Any result fields which contain "UNDETERMINED" were not able to be parsed,
+and should be examined manually.</p>
+<h2>{} totals</h2>""".format("Close" if search["closer"] is True else "Vote")
+	)
+
+	startdatestr = ""
+	if search["startdate"]:
+		datestr = datetime.datetime.strptime(search["startdate"], "%Y%m%d")
+		startdatestr = f" (from {datestr:'%b %d %Y'} and earlier)"
+	output.append(
+		"Total number of unique {} pages {} by {}{}: {}<br>".format(
+			venuelabel(search),
+			"closed" if search["closer"] is True else "edited",
+			username,
+			startdatestr,
+			analysis["total"],
+		)
+	)
+
+	if search["estimate"] is True:
+		output.append(
+			f"""A random sample of {analysis["analyzed"]} of these AfD pages, spread
+evenly over time, was analyzed to estimate the figures below.
+<a href="{APP_NAME}?name={username.replace(" ", "_")}&job=1{searchflags(search)}">
+Analyze all {analysis["total"]} in the background</a>.<br>"""
+		)
+	elif analysis["total"] > analysis["analyzed"]:
+		output.append(
+			f"""Only the last {maxsearch} AfD pages were analyzed.
+<a href="{APP_NAME}?name={username.replace(" ", "_")}&job=1{searchflags(search)}">
+Analyze all {analysis["total"]} in the background</a>.<br>"""
+		)
+
+	for line in analysis["devlog"]:
+		output.append(f"<pre>{html.escape(line)}</pre>")
+
+	output.append(
+		"""<small><a id href="javascript:void(0);" onClick="toggleNV(this)">
+Show pages {}</a></small>
+<ul id="noVote" style="display: none">""".format(
+			"whose close wasn't signed by this user"
+			if search["closer"] is True
+			else "without detected votes"
+		)
+	)
+	for page, closer in analysis["novotelist"]:
+		output.append(novoteitem(page, closer, wiki))
+	output.append("</ul>")
+	novotes = len(analysis["novotelist"])
+
+	if analysis["resume"]:
+		# The rest of a background job's AfDs are analyzed by another job
+		nexturl = "{}?name={}&cont={}{}{}".format(
+			APP_NAME,
+			username.replace(" ", "_"),
+			encodecursor(search, analysis["resume"]),
+			"&job=1" if maxsearch is None else "",
+			searchextras(search),
+		)
+	else:
+		nexturl = "{}?name={}&max={}{}{}".format(
+			APP_NAME,
+			username.replace(" ", "_"),
+			maxsearch,
+			f"&startdate={search['startdate']}" if search["startdate"] else "",
+			searchflags(search),
+		)
+	if analysis["partial"] is True and search["estimate"] is True:
+		output.append(
+			"""<p><b>This estimate is partial:</b> only {} of the {} sampled AfD pages
+were analyzed before time ran out or Wikipedia could not be reached.</p>""".format(
+				analysis["processed"], analysis["analyzed"]
+			)
+		)
+	elif analysis["partial"] is True and analysis["processed"] == analysis["analyzed"]:
+		output.append(
+			"""<p><b>These results are partial:</b> some signatures could not be
+checked for renamed accounts, because time ran out or the database could not be
+reached.</p>"""
+		)
+	elif analysis["partial"] is True:
+		output.append(
+			"""<p><b>These results are partial:</b> the analysis stopped after {} of {}
+AfD pages, because time ran out or Wikipedia could not be reached.
+<a href="{}">Continue with the remaining AfDs &rarr;</a></p>""".format(
+				analysis["processed"], analysis["analyzed"], nexturl
+			)
+		)
+	nextlink = ""
+	if search["estimate"] is True:
+		renderestimate(analysis, votetypes, output)
+	elif maxsearch is not None and analysis["total"] > analysis["processed"]:
+		nextlink = f'<a href="{nexturl}"><small>Next {maxsearch} AfDs &rarr;</small>'
+		nextlink += "</a><br>"
+	if search["closer"] is True:
+		renderclosures(analysis, tablelist, nextlink, output)
+		return
+	if search["trend"] is not None:
+		rendertrends(analysis, output)
+	##################Print results tables
+	totalvotes = 0
+	for i in votetypes:
+		totalvotes += votecounts[i]
+	if totalvotes > 0:
+		output.append("<ul>")
+		for i in votetypes:
 			output.append(
-				"""<br>
+				"<li>{} votes: {} ({:.1%})</li>".format(
+					OUTCOMES[i], votecounts[i], votecounts[i] / totalvotes
+				)
+			)
+		output.append("</ul>")
+		if novotes:
+			output.append(
+				f"The remaining {novotes} pages had no discernible vote by this user."
+			)
+		output.append(
+			"""<br>
 <h2>Voting matrix</h2>
 <p>This table compares the user's votes to the way the AfD eventually closed.
 The only AfDs included in this matrix are those that have already closed,
@@ -420,17 +1133,18 @@ whereas red cells indicate that the vote and the end result did not match.</p>
 <th colspan=9>Results</th>
 </tr>
 <tr>"""
-			)
-			for i in STATS_RESULTS:
-				output.append(f"<th>{i.upper()}</th>")
-			output.append("</tr>\n</thead>\n<tbody>\n<tr><th rowspan=9>Votes</th></tr>")
-			for vv in STATS_VOTES:
-				output.append(f"<tr>\n<th>{vv.upper()}</th>")
-				for rr in STATS_RESULTS:
-					output.append(f"{matrixmatch(stats, vv, rr)}{stats[vv + rr]}</td>")
-				output.append("</tr>")
-			output.append(
-				"""</tbody>
+		)
+		for i in STATS_RESULTS:
+			output.append(f"<th>{i.upper()}</th>")
+		output.append("</tr>\n</thead>\n<tbody>\n<tr><th rowspan=9>Votes</th></tr>")
+		for v, vv in enumerate(STATS_VOTES):
+			output.append(f"<tr>\n<th>{vv.upper()}</th>")
+			for r in range(len(STATS_RESULTS)):
+				cell = matrix[v * len(RESULT_TYPES) + r]
+				output.append(f"{matrixmatch(cell, v, r)}{cell}</td>")
+			output.append("</tr>")
+		output.append(
+			"""</tbody>
 </table>
 <br><div style="float:left;padding:20px;">
 <small>Abbreviation key:
@@ -445,53 +1159,37 @@ whereas red cells indicate that the vote and the end result did not match.</p>
 <br>NC = No Consensus</small></div>
 <div style="clear:both;"></div><br><br>
 <div style="width:875px;">"""
-			)
-
-			nextlink = ""
-			if len(tablelist) > 0 and tablelist[-1][2]:
-				nextlink = (
-					'<a href="{}?name={}&max={}&startdate={}{}{}{}{}">'.format(
-						APP_NAME,
-						username.replace(" ", "_"),
-						maxsearch,
-						datefmt(tablelist[-1][2]),
-						f"&altname={altusername}" if (altusername != "") else "",
-						"&undetermined=1" if (undetermined is True) else "",
-						"&nomsonly=1" if (nomsonly is True) else "",
-						"&dev=1" if (dev is True) else "",
-					)
-					+ f"<small>Next {maxsearch} AfDs &rarr;</small></a><br>"
-				)
+		)
 
-			afd_rows = []
-			for i in tablelist:
-				afd_rows.append(afdrow(matchstats, i))  # update matchstats
+		afd_rows = []
+		for i in tablelist:
+			afd_rows.append(afdrow(matchstats, i, wiki))  # update matchstats
 
-			total_votes = sum(matchstats)
-			if total_votes > 0:
-				matchstrs = [
-					"vote matched result (green cells)",
-					"vote didn't match result (red cells)",
-					'result was "No Consensus" (yellow cells)',
-				]
-				for i in range(3):
-					output.append(
-						"Number of AfDs where {}: {} ({:.1%})<br>".format(
-							matchstrs[i],
-							matchstats[i],
-							float(matchstats[i]) / total_votes,
-						)
+		total_votes = sum(matchstats)
+		if total_votes > 0:
+			matchstrs = [
+				"vote matched result (green cells)",
+				"vote didn't match result (red cells)",
+				'result was "No Consensus" (yellow cells)',
+			]
+			for i in range(3):
+				output.append(
+					"Number of AfDs where {}: {} ({:.1%})<br>".format(
+						matchstrs[i],
+						matchstats[i],
+						float(matchstats[i]) / total_votes,
 					)
-				if total_votes != matchstats[2]:
-					output.append(
-						'Without considering "No Consensus" results, <b>'
-						+ "{:.1%} of AfDs were matches</b> and {:.1%} were not.".format(
-							float(matchstats[0]) / (total_votes - matchstats[2]),
-							float(matchstats[1]) / (total_votes - matchstats[2]),
-						)
+				)
+			if total_votes != matchstats[2]:
+				output.append(
+					'Without considering "No Consensus" results, <b>'
+					+ "{:.1%} of AfDs were matches</b> and {:.1%} were not.".format(
+						float(matchstats[0]) / (total_votes - matchstats[2]),
+						float(matchstats[1]) / (total_votes - matchstats[2]),
 					)
-			output.append(
-				f"""<h2>Individual AfDs</h2>
+				)
+		output.append(
+			f"""<h2>Individual AfDs</h2>
 {nextlink}
 </div>
 <table>
@@ -504,82 +1202,933 @@ whereas red cells indicate that the vote and the end result did not match.</p>
 </tr>
 </thead>
 <tbody>"""
-			)
-			output.append("\n".join(afd_rows))
-			output.append(
-				f"""</tbody>
+		)
+		output.append("\n".join(afd_rows))
+		output.append(
+			f"""</tbody>
 </table>
 <div style="width:875px;">{nextlink}<br>"""
+		)
+	else:
+		output.append(f"<br><br>No votes found.<!--{votecounts}--><br>{nextlink}")
+
+
+def rendertrends(analysis, output):
+	# Compact table of the trend= buckets, oldest first
+	output.append(
+		"""<h2>Votes by {}</h2>
+<table class="trend">
+<thead>
+<tr>
+	<th scope="col">Period</th>
+	<th scope="col">Votes</th>
+	<th scope="col">Matches</th>
+	<th scope="col">Non-matches</th>
+	<th scope="col">No consensus</th>
+	<th scope="col">Match rate</th>
+</tr>
+</thead>
+<tbody>""".format(analysis["search"]["trend"])
+	)
+	for bucket in analysis["trends"]:
+		rate = bucket["matchrate"]
+		output.append(
+			"""<tr>
+	<td>{}</td>
+	<td>{}</td>
+	<td>{}</td>
+	<td>{}</td>
+	<td>{}</td>
+	<td>{}</td>
+</tr>""".format(
+				bucket["period"],
+				sum(bucket["votecounts"]),
+				*bucket["matchstats"],
+				"" if rate is None else f"{rate:.1%}",
 			)
-		else:
-			output.append(f"<br><br>No votes found.<!--{stats}-->")
+		)
+	output.append("</tbody>\n</table>")
 
+
+def renderclosures(analysis, tablelist, nextlink, output):
+	# Result distribution, deletion review rate and closes per month for
+	# role=closer
+	closecounts = analysis["closecounts"]
+	wiki = WIKIS[analysis["search"]["wiki"]]
+	total = len(tablelist)
+	if total == 0:
+		output.append(f"<br><br>No closes found.<br>{nextlink}")
+		return
+	output.append("<ul>")
+	for code, count in enumerate(closecounts):
+		if count > 0:
+			output.append(f"<li>{OUTCOMES[code]}: {count} ({count / total:.1%})</li>")
+	output.append("</ul>")
+	reviewed = sum(1 for i in tablelist if i.drv)
+	output.append(
+		f"Closes taken to deletion review: {reviewed} ({reviewed / total:.1%})<br>"
+	)
+	output.append(
+		"""<h2>Closes per month</h2>
+<table>
+<thead>
+<tr>
+	<th scope="col">Month</th>
+	<th scope="col">Closes</th>
+</tr>
+</thead>
+<tbody>"""
+	)
+	for month in sorted(analysis["months"], reverse=True):
 		output.append(
-			f"<small>Elapsed time: {(time.time() - starttime):.2f} seconds.</small><br>"
+			f"<tr>\n\t<td>{month}</td>\n\t<td>{analysis['months'][month]}</td>\n</tr>"
 		)
-		start_response("200 OK", [("Content-Type", "text/html")])
-		return [HTML_TEMPLATE.format("\n".join(output)).encode("utf-8")]
+	output.append(
+		f"""</tbody>
+</table>
+<h2>Individual closes</h2>
+{nextlink}
+</div>
+<table>
+<thead>
+<tr>
+	<th scope="col">Page</th>
+	<th scope="col">Close date</th>
+	<th scope="col">Result</th>
+</tr>
+</thead>
+<tbody>"""
+	)
+	for i in tablelist:
+		output.append(
+			f"""<tr>
+	<td>{link(i.page, wiki)}</td>
+	<td>{i.votetime}</td>
+	<td>{OUTCOMES[i.result]}{drvlinks(i.drv, wiki)}</td>
+</tr>"""
+		)
+	output.append(
+		f"""</tbody>
+</table>
+<div style="width:875px;">{nextlink}<br>"""
+	)
 
-	except SystemExit:
-		sys.exit(0)
+
+def renderestimate(analysis, votetypes, output):
+	# Match rate and vote distribution of a mode=estimate sample, with 95%
+	# confidence intervals (ESTIMATE_Z) for the user's whole history
+	votecounts = analysis["votecounts"]
+	fraction = analysis["processed"] / analysis["total"]
+	matchstats = [0, 0, 0]
+	for i in analysis["tablelist"]:
+		match = MATCH_CLASSES[i[1] * len(OUTCOMES) + i[3]]
+		if match is not None:
+			matchstats[match] += 1
+	output.append("<h2>Estimate</h2>\n<ul>")
+	judged = matchstats[0] + matchstats[1]
+	if judged > 0:
+		low, high = wilson(matchstats[0], judged, fraction)
+		output.append(
+			f"""<li><b>{matchstats[0] / judged:.1%} of AfDs were matches</b>
+(95% confidence interval {low:.1%}&ndash;{high:.1%}),
+without considering "No Consensus" results</li>"""
+		)
+	totalvotes = sum(votecounts[i] for i in votetypes)
+	for i in votetypes:
+		if totalvotes > 0 and votecounts[i] > 0:
+			low, high = wilson(votecounts[i], totalvotes, fraction)
+			output.append(
+				f"<li>{OUTCOMES[i]} votes: {votecounts[i] / totalvotes:.1%} "
+				f"({low:.1%}&ndash;{high:.1%})</li>"
+			)
+	output.append("</ul>")
+
+
+def searchflags(search):
+	# Query string for the options a follow-up search should carry over
+	return "{}{}{}{}{}{}{}".format(
+		f"&altname={search['altusername']}" if (search["altusername"] != "") else "",
+		"&undetermined=1" if (search["undetermined"] is True) else "",
+		"&nomsonly=1" if (search["nomsonly"] is True) else "",
+		"&extract=diff" if (search["extractdiff"] is True) else "",
+		"&dev=1" if (search["dev"] is True) else "",
+		"&role=closer" if (search["closer"] is True) else "",
+		searchextras(search),
+	)
+
+
+def searchextras(search):
+	# The options a continuation cursor doesn't carry
+	return "{}{}{}".format(
+		f"&trend={search['trend']}" if search["trend"] is not None else "",
+		f"&wiki={search['wiki']}" if search["wiki"] != DEFAULT_WIKI.name else "",
+		f"&venue={search['venue']}" if search["venue"] != "afd" else "",
+	)
+
+
+def jobpath(jobid, queue=""):
+	return os.path.join(JOB_DIR, queue, jobid if queue else f"{jobid}.json")
+
+
+def loadjob(jobid):
+	if not JOB_ID_PATTERN.fullmatch(jobid):
+		return None
+	try:
+		with open(jobpath(jobid)) as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return None
+
+
+def savejob(job):
+	# Written to a temporary file first so pollers never see half a job
+	job["updated"] = time.time()
+	tmp = f"{jobpath(job['id'])}.{os.getpid()}.tmp"
+	with open(tmp, "w") as f:
+		json.dump(job, f)
+	os.replace(tmp, jobpath(job["id"]))
+
+
+def submitjob(search):
+	# Queues a full-history analysis for the background worker (jobworker.py).
+	# The same search maps to the same job, so resubmitting doesn't add work.
+	# A continuation (after) of a partial job is a job of its own.
+	search = dict(
+		search,
+		job=False,
+		estimate=False,
+		format="html",
+		maxsearch=None,
+	)
+	key = json.dumps(search, sort_keys=True).encode("utf-8")
+	jobid = hashlib.sha1(key).hexdigest()[:16]
+	job = loadjob(jobid)
+	if job is None or (
+		job["status"] in ("done", "failed") and job["updated"] < time.time() - JOB_TTL
+	):
+		for queue in ("", "queue", "running"):
+			os.makedirs(os.path.join(JOB_DIR, queue), exist_ok=True)
+		job = {
+			"id": jobid,
+			"search": search,
+			"status": "queued",
+			"processed": 0,
+			"total": None,
+		}
+		savejob(job)
+		open(jobpath(jobid, "queue"), "w").close()
+	return job
+
+
+def runjob(jobid):
+	# Called by the worker for a job it has claimed from the queue
+	job = loadjob(jobid)
+	if job is None:
+		return
+	job["status"] = "running"
+	savejob(job)
+	lastsave = [time.time()]
+
+	def progress(event):
+		if event["stage"] != "page":
+			return
+		job["processed"], job["total"] = event["processed"], event["total"]
+		if time.time() - lastsave[0] >= JOB_PROGRESS_INTERVAL:
+			savejob(job)
+			lastsave[0] = time.time()
+
+	try:
+		analysis = analyze(job["search"], progress=progress)
 	except Exception as err:
+		analysis = f"{html.escape(str(err))}<br>Fatal error."
+	if isinstance(analysis, str):
+		job["status"] = "failed"
+		job["error"] = analysis
+	else:
+		job["status"] = "done"
+		job["analysis"] = analysis
+	savejob(job)
+
+
+def jobpage(start_response, output, jobid):
+	# Shows a background job's progress, or its results once it is done
+	job = loadjob(jobid)
+	if job is None:
+		return errorout(start_response, output, "No such job.")
+	username = job["search"]["username"]
+	output.append(
+		"<h1>{} Statistics for User:{}</h1>".format(
+			venuelabel(job["search"]), html.escape(username)
+		)
+	)
+	if job["status"] == "failed":
+		return errorout(start_response, output, job["error"])
+	if job["status"] == "done":
+		render(job["analysis"], output)
+	else:
+		if job["total"]:
+			progress = f"{job['processed']} of {job['total']} AfD pages analyzed"
+		else:
+			progress = "waiting to start"
+		output.append(
+			f"""<p>The full AfD history of this user is being analyzed in the
+background ({progress}). This page will refresh itself until the results are ready,
+or you can come back to <a href="{APP_NAME}?jobid={jobid}">this link</a> later.</p>
+<script>setTimeout(function () {{ location.reload(); }}, 10000);</script>"""
+		)
+	start_response("200 OK", [("Content-Type", "text/html")])
+	return [HTML_TEMPLATE.format("\n".join(output)).encode("utf-8")]
+
+
+def eventstream(start_response, search, starttime):
+	# format=events: Server-Sent Events with analyze()'s progress events as
+	# they happen, then a "done" event with the page the search would have
+	# shown. The search runs in a thread of its own, handing its events over
+	# through a queue, while this one writes them out. The thread caches the
+	# result itself, so it isn't lost if the client goes away first.
+	events = queue.Queue()
+	htmlsearch = dict(search, format="html")
+
+	def run():
+		try:
+			analysis = analyze(search, starttime + REQUEST_BUDGET, events.put)
+		except Exception as err:
+			analysis = f"{html.escape(str(err))}<br>Fatal error."
+		rendered = None
+		if not isinstance(analysis, str):
+			body = []
+			render(analysis, body)
+			rendered = "\n".join(body)
+			if analysis["partial"] is False and search["dev"] is False:
+				putresponse(htmlsearch, analysis, rendered)
+		events.put({"stage": "analyzed", "analysis": analysis, "rendered": rendered})
+
+	start_response(
+		"200 OK",
+		[
+			("Content-Type", "text/event-stream"),
+			("Cache-Control", "no-cache"),
+			("X-Accel-Buffering", "no"),  # don't let the proxy hold events back
+		],
+	)
+	output = [
+		"<h1>{} Statistics for User:{}</h1>".format(
+			venuelabel(search), html.escape(search["username"])
+		)
+	]
+	rendered = getresponse(htmlsearch)
+	if rendered is None:
+		threading.Thread(target=run, daemon=True).start()
+		while True:
+			try:
+				event = events.get(timeout=EVENT_KEEPALIVE)
+			except queue.Empty:
+				yield b": keepalive\n\n"
+				continue
+			if event["stage"] != "analyzed":
+				yield sseevent(event["stage"], event)
+				continue
+			analysis, rendered = event["analysis"], event["rendered"]
+			break
+		if rendered is None:
+			page = errorout(lambda status, headers: None, output, analysis)[0]
+			yield sseevent("done", {"html": page.decode("utf-8")})
+			return
+	output.append(rendered)
+	output.append(
+		f"<small>Elapsed time: {(time.time() - starttime):.2f} seconds.</small><br>"
+	)
+	yield sseevent("done", {"html": HTML_TEMPLATE.format("\n".join(output))})
+
+
+def sseevent(name, data):
+	return f"event: {name}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+
+def csvexport(start_response, search, starttime):
+	# format=csv: the rows of the results table, streamed out as CSV
+	analysis = analyze(search, starttime + REQUEST_BUDGET)
+	if isinstance(analysis, str):
+		start_response(
+			"500 Internal Server Error", [("Content-Type", "text/plain; charset=utf-8")]
+		)
+		return [HTML_TAG_PATTERN.sub("", analysis).encode("utf-8")]
+	filename = urllib.parse.quote(f"afdstats-{search['username']}.csv")
+	start_response(
+		"200 OK",
+		[
+			("Content-Type", "text/csv; charset=utf-8"),
+			("Content-Disposition", f"attachment; filename*=UTF-8''{filename}"),
+		],
+	)
+	return csvchunks(exportrows(analysis))
+
+
+def csvchunks(rows):
+	buffer = io.StringIO()
+	writer = csv.writer(buffer)
+	writer.writerow(EXPORT_COLUMNS)
+	for row in rows:
+		writer.writerow(row)
+		if buffer.tell() >= CSV_CHUNK_BYTES:
+			yield buffer.getvalue().encode("utf-8")
+			buffer.seek(0)
+			buffer.truncate()
+	yield buffer.getvalue().encode("utf-8")
+
+
+def exportrows(analysis):
+	# What afdrow() shows for each AfD, as plain values in EXPORT_COLUMNS
+	# order. Closes have no vote, so no match either.
+	for record in analysis["tablelist"]:
+		record = AfDRecord(*record)
+		match = None
+		if record.vote is not None:
+			match = MATCH_CLASSES[record.vote * len(OUTCOMES) + record.result]
+		yield (
+			record.page,
+			record.votetime,
+			"" if record.vote is None else OUTCOMES[record.vote],
+			record.nom,
+			OUTCOMES[record.result],
+			"" if match is None else MATCH_NAMES[match],
+			len(record.drv),
+		)
+
+
+def participantspage(start_response, output, form, starttime):
+	# page=: everyone who voted at one AfD, from the same parsed entry that
+	# user searches read
+	title = urllib.parse.unquote_plus(form["page"][0]).strip().replace(" ", "_")
+	title = re.sub("^(?:Wikipedia|WP|Project):", "", title, flags=re.IGNORECASE)
+	wiki = WIKIS.get(form.get("wiki", [""])[0].lower(), DEFAULT_WIKI)
+	venue = venueof(title, wiki)
+	if venue is None or venue.daily is True:
+		venue = next(v for v in wiki.venues.values() if v.daily is False)
+		title = venue.prefix + title
+	if title == venue.prefix:
+		return errorout(start_response, output, "No AfD entered.")
+	undetermined = form.get("undetermined", [""])[0].lower() in TRUES
+	deadline = starttime + REQUEST_BUDGET
+
+	entry = queryafd(title, deadline, wiki)
+	if entry is None:
 		return errorout(
 			start_response,
 			output,
-			f"""{html.escape(str(err))}<br>
-{html.escape(traceback.format_exc())}<br>
-Fatal error.""",
+			f"There is no page named Wikipedia:{html.escape(title)}.",
 		)
+	hit = cache.get(wikins(wiki, "parsed"), parsedkey(title, None, int(entry[8])))
+	if hit is not None:
+		parsedafd = json.loads(hit)
+	else:
+		pagedict = {}
+		for batch, newdata in APIpagedata([entry], None, None, deadline, wiki):
+			pagedict.update(newdata)
+		data = pagedict.get("Wikipedia:" + title.replace("_", " "))
+		if data is None:
+			return errorout(
+				start_response, output, "Unable to fetch page data. Please try again."
+			)
+		parsedafd = parseafd(data, title, False, wiki)
+		cacheparsed(title, None, int(entry[8]), parsedafd, wiki)
+	result_data, result, deletionreviews, participants = parsedafd
 
+	# Each participant's last vote, as in user searches; a nominator who
+	# didn't bold a vote of their own counts as a Delete
+	nominator = (entry[1] or b"").decode().replace("_", " ")
+	votes = {}
+	if nominator:
+		created = datetime.datetime.strptime(entry[2].decode(), "%Y%m%d%H%M%S")
+		votes[nominator.lower()] = AfDRecord(
+			nominator,
+			OUTCOME_CODES["Delete"],
+			created.strftime("%B %d, %Y"),
+			result,
+			1,
+			[],
+		)
+	signers = trysigners({p[0] for p in participants}, deadline, wiki)[0]
+	for voter, votetype, votetime in participants:
+		voter = signers[voter]
+		isnom = voter.lower() == nominator.lower()
+		if votetype == UNDETERMINED and (undetermined is False or isnom is True):
+			continue
+		nom = 1 if isnom else 0
+		votes[voter.lower()] = AfDRecord(voter, votetype, votetime, result, nom, [])
 
-def queryDB(startdatestr, nomsonly, username):
+	output.append(f"<h1>{venue.name} participants: {link(title, wiki)}</h1>")
+	# An open AfD's head runs up to the nomination, which isn't a close
+	closer = findsigner(result_data) if result != NOT_CLOSED else None
+	output.append(
+		"<p>Result: {}{}{}</p>".format(
+			OUTCOMES[result],
+			drvlinks(deletionreviews, wiki),
+			f" (closer: {html.escape(closer.group(1).strip())})" if closer else "",
+		)
+	)
+	votecounts = [0] * len(OUTCOMES)
+	for record in votes.values():
+		votecounts[record.vote] += 1
+	if votes:
+		output.append("<ul>")
+		for i, count in enumerate(votecounts):
+			if count:
+				output.append(f"<li>{OUTCOMES[i]} votes: {count}</li>")
+		output.append("</ul>")
+		output.append(
+			"""<table>
+<thead>
+<tr>
+	<th scope="col">Participant</th>
+	<th scope="col">Vote date</th>
+	<th scope="col">Vote</th>
+</tr>
+</thead>
+<tbody>"""
+		)
+		for record in votes.values():
+			match = MATCH_CLASSES[record.vote * len(OUTCOMES) + record.result]
+			output.append(
+				"""<tr>
+	<td><a href="{}?name={}{}">{}</a></td>
+	<td>{}</td>
+	<td class="{}">{}{}</td>
+</tr>""".format(
+					APP_NAME,
+					urllib.parse.quote(record.page.replace(" ", "_")),
+					f"&wiki={wiki.name}" if wiki != DEFAULT_WIKI else "",
+					html.escape(record.page),
+					record.votetime,
+					"m" if match is None else "ynm"[match],
+					OUTCOMES[record.vote],
+					" (Nom)" if record.nom == 1 else "",
+				)
+			)
+		output.append("</tbody>\n</table>")
+	else:
+		output.append("<br>No votes found.<br>")
+	output.append(
+		f"<small>Elapsed time: {(time.time() - starttime):.2f} seconds.</small><br>"
+	)
+	start_response("200 OK", [("Content-Type", "text/html")])
+	return [HTML_TEMPLATE.format("\n".join(output)).encode("utf-8")]
+
+
+def queryDB(
+	startdatestr,
+	nomsonly,
+	username,
+	after=None,
+	deadline=None,
+	closer=False,
+	venues=None,
+	wiki=DEFAULT_WIKI,
+):
+	# Returns None if the user doesn't exist, so that can be told apart from a
+	# user who simply has no AfD edits without running the full join.
+	# Pages are ordered by the user's last edit to them, then page id; with
+	# after, a (rev_timestamp, page_id) keyset position, only the pages that
+	# follow it are queried. Rows are (title, creator, user's first edit time,
+	# largest edit, page_len, "parent:rev:delta" edits, user's last edit time,
+	# page id, latest revision). With closer, only the pages the user closed
+	# are queried, going by their edit summaries, and the time is the close's.
+	# The pages of every venue given (AfD by default) come in one query.
 	##################Query database
-	querystr = """SELECT page_title, {}
+	querystr = """SELECT page_title, {}, MAX(rev.rev_timestamp) AS last_ts,
+page.page_id, page.page_latest
 FROM revision_userindex AS rev
 JOIN page ON rev.rev_page=page_id
 JOIN actor_revision AS actor ON actor.actor_id=rev.rev_actor
+LEFT JOIN revision AS parent ON parent.rev_id=rev.rev_parent_id
 {} WHERE actor.actor_name=%s
 AND page_namespace=4
-AND page_title LIKE "Articles_for_deletion%%"
-AND NOT page_title LIKE "Articles_for_deletion/Log/%%"
-{} {} ORDER BY rev.rev_timestamp DESC;"""
-	if nomsonly is True:
+AND ({})
+{} {} {} {} ORDER BY last_ts DESC, page.page_id DESC;"""
+	titles = []
+	for venue in venues or [next(iter(wiki.venues.values()))]:
+		title = f'page_title LIKE "{venue.prefix}%%"'
+		if venue.log is not None:
+			title += f' AND NOT page_title LIKE "{venue.log}%%"'
+		titles.append(f"({title})")
+	titlestr = "\nOR ".join(titles)
+	params = (username,)
+	afterstr = ""
+	havingstr = ""
+	if after:
+		afterstr = "AND rev.rev_timestamp<=%s"
+		params += (after[0],)
+		if nomsonly is False and closer is False:
+			# Pages the user also edited later were shown already
+			afterstr += """ AND NOT EXISTS (SELECT 1 FROM revision_userindex AS later
+WHERE later.rev_page=page_id AND later.rev_actor=rev.rev_actor
+AND later.rev_timestamp>%s)"""
+			params += (after[0],)
+		havingstr = "HAVING last_ts<%s OR page.page_id<%s"
+		params += (after[0], after[1])
+	if closer is True:
 		querystr = querystr.format(
-			"actor.actor_name, rev.rev_timestamp",
+			"""actor.actor_name, MAX(rev.rev_timestamp), NULL, page_len, NULL""",
+			"JOIN comment_revision AS comment ON comment.comment_id=rev.rev_comment_id",
+			titlestr,
+			startdatestr,
+			afterstr,
+			"""AND (LOWER(CONVERT(comment.comment_text USING utf8mb4)) LIKE "%%closed as%%"
+OR LOWER(CONVERT(comment.comment_text USING utf8mb4)) LIKE "%%result was%%"
+OR LOWER(CONVERT(comment.comment_text USING utf8mb4)) LIKE "%%closing debate%%")
+GROUP BY page.page_id""",
+			havingstr,
+		)
+	elif nomsonly is True:
+		querystr = querystr.format(
+			"""actor.actor_name, rev.rev_timestamp, rev.rev_len, page_len,
+CONCAT(rev.rev_parent_id, ':', rev.rev_id, ':', rev.rev_len)""",
 			"",
+			titlestr,
 			startdatestr,
-			"AND rev.rev_parent_id=0",
+			afterstr,
+			"AND rev.rev_parent_id=0 GROUP BY page.page_id",
+			havingstr,
 		)
 	else:
+		# The creator is looked up later by firstcreators(), for only the pages
+		# that get analyzed
 		querystr = querystr.format(
-			"first_actor.actor_name, MIN(rev.rev_timestamp) AS rev_timestamp",
-			"""JOIN revision_userindex AS first_rev ON first_rev.rev_page=page_id
-AND first_rev.rev_parent_id=0
-JOIN actor_revision AS first_actor ON first_actor.actor_id=first_rev.rev_actor""",
+			"""NULL, MIN(rev.rev_timestamp) AS rev_timestamp,
+MAX(CAST(rev.rev_len AS SIGNED) - CAST(IFNULL(parent.rev_len, 0) AS SIGNED)),
+page_len, GROUP_CONCAT(CONCAT(rev.rev_parent_id, ':', rev.rev_id, ':',
+CAST(rev.rev_len AS SIGNED) - CAST(IFNULL(parent.rev_len, 0) AS SIGNED))
+ORDER BY rev.rev_timestamp ASC SEPARATOR ' ')""",
+			"",
+			titlestr,
 			startdatestr,
-			"GROUP BY page.page_title, first_actor.actor_name",
+			afterstr,
+			"GROUP BY page.page_id",
+			havingstr,
 		)
 
-	db = pymysql.connect(
-		database="enwiki_p",
-		host="enwiki.web.db.svc.wikimedia.cloud",
-		read_default_file=os.path.expanduser("~/replica.my.cnf"),
-	)
-	with db:
+	with connectDB(deadline, wiki) as db:
 		with db.cursor() as cursor:
+			cursor.execute("SELECT 1 FROM actor WHERE actor_name=%s", (username,))
+			if cursor.fetchone() is None:
+				return None
 			cursor.execute(
 				querystr,
-				(username,),
+				params,
 			)
 			results = cursor.fetchall()
 	return results
 
 
-def parsevote(v):
-	for key, vote in VOTE_MAP.items():
+class CountingCursor(pymysql.cursors.Cursor):
+	def execute(self, query, args=None):
+		dbqueries[0] += 1
+		return super().execute(query, args)
+
+
+@contextmanager
+def connectDB(deadline=None, wiki=DEFAULT_WIKI):
+	# Lends out a connection to the wiki's replica, with statements cut off at
+	# the deadline. Connections go back to the wiki's pool afterwards, unless
+	# something went wrong with them or the pool is full. No more than
+	# DB_MAX_CONNECTIONS are lent out at once.
+	timeout = None if deadline is None else max(1, int(deadline - time.time()))
+	if not dbslots.acquire(timeout=timeout):
+		raise pymysql.err.OperationalError(0, "No replica connection came free in time")
+	try:
+		pool = dbpools.setdefault(wiki.name, [])
+		try:
+			db = pool.pop()
+			db.ping(reconnect=True)
+		except IndexError:
+			db = pymysql.connect(
+				database=wiki.dbname,
+				host=wiki.host,
+				read_default_file=os.path.expanduser("~/replica.my.cnf"),
+				cursorclass=CountingCursor,
+			)
+		db._read_timeout = timeout  # pymysql applies this before every read
+		with db.cursor() as cursor:
+			cursor.execute("SET SESSION max_statement_time=%s", (timeout or 0,))
+		try:
+			yield db
+		except Exception:
+			if db.open:
+				db.close()
+			raise
+		if len(pool) < DB_POOL_SIZE:
+			pool.append(db)
+		else:
+			db.close()
+	finally:
+		dbslots.release()
+
+
+def firstcreators(pages, deadline=None, wiki=DEFAULT_WIKI):
+	# Fills in who created each AfD, which queryDB leaves out outside
+	# nomsonly, with one query for the pages not already cached. The creator
+	# of a page never changes, so they are cached by page id for good.
+	creators = {}
+	missing = []
+	for entry in pages:
+		if entry[1] is None:
+			hit = cache.get(wikins(wiki, "creator"), int(entry[7]))
+			if hit is None:
+				missing.append(int(entry[7]))
+			else:
+				creators[int(entry[7])] = hit
+	if missing:
+		with connectDB(deadline, wiki) as db:
+			with db.cursor() as cursor:
+				cursor.execute(
+					"""SELECT rev_page, actor_name FROM revision
+JOIN actor_revision ON actor_id=rev_actor
+WHERE rev_parent_id=0 AND rev_page IN %s""",
+					(missing,),
+				)
+				for pageid, creator in cursor.fetchall():
+					creators[int(pageid)] = creator
+					key = int(pageid)
+					cache.put(wikins(wiki, "creator"), key, creator, CREATOR_CACHE_TTL)
+	# Pages whose creation can't be seen (e.g. it was suppressed) have none
+	return [
+		e if e[1] is not None else e[:1] + (creators.get(int(e[7]), b""),) + e[2:]
+		for e in pages
+	]
+
+
+def resolvesigners(names, deadline=None, wiki=DEFAULT_WIKI):
+	# Maps the names signatures link to onto the accounts behind them today,
+	# following renames (from the rename log) and user pages that redirect to
+	# another user's page. Names already resolved come from the cache; the
+	# rest are looked up together, one hop of renames and redirects at a time.
+	resolved = {}
+	missing = []
+	for name in names:
+		hit = cache.get(wikins(wiki, "signer"), name)
+		if hit is None:
+			missing.append(name)
+		else:
+			resolved[name] = hit.decode("utf-8")
+	current = {name: name for name in missing}
+	pending = set(missing)
+	for hop in range(SIGNER_HOPS):
+		if not pending:
+			break
+		targets = querysigners(sorted(pending), deadline, wiki)
+		pending = set()
+		for name, at in current.items():
+			if at in targets and targets[at] != at:
+				current[name] = targets[at]
+				pending.add(targets[at])
+	for name, at in current.items():
+		resolved[name] = at
+		value = at.encode("utf-8")
+		cache.put(wikins(wiki, "signer"), name, value, SIGNER_CACHE_TTL)
+	return resolved
+
+
+def trysigners(names, deadline=None, wiki=DEFAULT_WIKI):
+	# resolvesigners(), and whether it worked. Late in a search the replica's
+	# statement timeout is short enough for the lookup to fail; signatures
+	# are then taken as they are, and the results count as partial.
+	try:
+		return resolvesigners(names, deadline, wiki), True
+	except pymysql.MySQLError:
+		return {name: name for name in names}, False
+
+
+def querysigners(names, deadline=None, wiki=DEFAULT_WIKI):
+	# One hop for each name: who it was renamed to, or failing that, whose
+	# user page its user page redirects to
+	titles = {}
+	for name in names:
+		if name:
+			title = (name[0].upper() + name[1:]).replace(" ", "_")
+			titles.setdefault(title, []).append(name)
+	targets = {}
+	titlelist = sorted(titles)
+	with connectDB(deadline, wiki) as db:
+		with db.cursor() as cursor:
+			for i in range(0, len(titlelist), SIGNER_BATCH):
+				chunk = titlelist[i : i + SIGNER_BATCH]
+				cursor.execute(
+					"""SELECT page_title, rd_title FROM page
+JOIN redirect ON rd_from=page_id
+WHERE page_namespace=2 AND page_title IN %s
+AND rd_namespace=2 AND rd_interwiki=''""",
+					(chunk,),
+				)
+				for title, target in cursor.fetchall():
+					target = target.decode().split("/")[0].replace("_", " ")
+					for name in titles.get(title.decode(), []):
+						targets[name] = target
+				cursor.execute(
+					"""SELECT log_title, log_params FROM logging_logindex
+WHERE log_type='renameuser' AND log_namespace=2 AND log_title IN %s
+ORDER BY log_timestamp""",
+					(chunk,),
+				)
+				for title, params in cursor.fetchall():
+					params = params.decode("utf-8", "replace")
+					if params.startswith("a:"):
+						newname = RENAME_PARAMS_PATTERN.search(params)
+						newname = None if newname is None else newname.group(1)
+					else:  # old entries only hold the new name, on the first line
+						newname = params.split("\n")[0]
+					if newname:
+						for name in titles.get(title.decode(), []):
+							targets[name] = newname.replace("_", " ")
+	return targets
+
+
+def queryafd(title, deadline=None, wiki=DEFAULT_WIKI):
+	# Returns one AfD as a row shaped like queryDB's, with its creator and when
+	# they created it, or None if there is no such page
+	with connectDB(deadline, wiki) as db:
+		with db.cursor() as cursor:
+			cursor.execute(
+				"""SELECT page_title, actor_name, rev_timestamp, NULL,
+page_len, NULL, NULL, page_id, page_latest
+FROM page
+LEFT JOIN revision ON rev_page=page_id AND rev_parent_id=0
+LEFT JOIN actor_revision ON actor_id=rev_actor
+WHERE page_namespace=4 AND page_title=%s""",
+				(title,),
+			)
+			return cursor.fetchone()
+
+
+def stratifiedsample(results, size, rng):
+	# Draws size rows from results, which are in time order, by cutting them
+	# into ESTIMATE_STRATA equal spans and sampling each span in proportion
+	if len(results) <= size:
+		return list(results)
+	strata = min(ESTIMATE_STRATA, size)
+	sample = []
+	for h in range(strata):
+		stratum = results[len(results) * h // strata : len(results) * (h + 1) // strata]
+		take = size * (h + 1) // strata - size * h // strata
+		for i in sorted(rng.sample(range(len(stratum)), take)):
+			sample.append(stratum[i])
+	return sample
+
+
+def wilson(k, n, fraction=0.0):
+	# Wilson score interval for k out of n, narrowed by the finite population
+	# correction when the sample is that fraction of all of the user's AfDs
+	if n == 0:
+		return 0.0, 1.0
+	p = k / n
+	if fraction >= 1:
+		return p, p
+	n = n / (1 - fraction)
+	z2 = ESTIMATE_Z**2
+	centre = (p + z2 / (2 * n)) / (1 + z2 / n)
+	half = ESTIMATE_Z * math.sqrt(p * (1 - p) / n + z2 / (4 * n * n)) / (1 + z2 / n)
+	return max(0.0, centre - half), min(1.0, centre + half)
+
+
+def getresponse(search):
+	# Returns a rendered result for the search, unless the user has edited an
+	# AfD since or one of its AfDs has changed, as far as rcwatcher.py has seen
+	wiki = WIKIS[search["wiki"]]
+	generation = int(cache.get(wikins(wiki, "usergen"), search["username"]) or 0)
+	hit = cache.get("response", [search, generation])
+	if hit is None:
+		return None
+	hit = json.loads(hit)
+	for page, revid in hit["revisions"].items():
+		latest = cache.get(wikins(wiki, "latest"), page)
+		if latest is not None and int(latest) > revid:
+			return None
+	return hit["body"]
+
+
+def putresponse(search, analysis, body):
+	# Rendered results are only trusted for long while rcwatcher.py is running.
+	# Returns how long this one is kept for.
+	wiki = WIKIS[search["wiki"]]
+	generation = int(cache.get(wikins(wiki, "usergen"), search["username"]) or 0)
+	ttl = RESPONSE_CACHE_TTL
+	if cache.get("watcher", "heartbeat") is not None:
+		ttl = WATCHED_RESPONSE_CACHE_TTL
+	value = json.dumps({"revisions": analysis["revisions"], "body": body})
+	cache.put("response", [search, generation], value.encode("utf-8"), ttl)
+	return ttl
+
+
+def negcacheget(key, wiki=DEFAULT_WIKI):
+	# Returns the cached error for a search known to find nothing, if fresh
+	errorstr = cache.get(wikins(wiki, "negative"), key)
+	return None if errorstr is None else errorstr.decode("utf-8")
+
+
+def negcacheset(key, errorstr, wiki=DEFAULT_WIKI):
+	value = errorstr.encode("utf-8")
+	cache.put(wikins(wiki, "negative"), key, value, NEGATIVE_CACHE_TTL)
+
+
+def wikins(wiki, namespace):
+	# Each wiki's entries live in their own cache namespaces. Page titles and
+	# ids are only unique within a wiki. enwiki keeps the plain names it
+	# had before there were others.
+	return namespace if wiki == DEFAULT_WIKI else f"{wiki.name}-{namespace}"
+
+
+def venueof(title, wiki=DEFAULT_WIKI):
+	# The venue a discussion page belongs to, or None for other pages
+	title = title.replace(" ", "_").split("#")[0]
+	for venue in wiki.venues.values():
+		if title.startswith(venue.prefix) and not (
+			venue.log is not None and title.startswith(venue.log)
+		):
+			return venue
+	return None
+
+
+def searchvenues(search):
+	# Nominations and closes are only known for venues with a page per
+	# discussion, going by who created it and the closing edit summary
+	wikivenues = WIKIS[search["wiki"]].venues
+	if search["venue"] == "all":
+		venues = list(wikivenues.values())
+	else:
+		venues = [wikivenues[search["venue"]]]
+	if search["nomsonly"] is True or search["closer"] is True:
+		venues = [venue for venue in venues if venue.daily is False]
+	return venues
+
+
+def venuelabel(search):
+	if search["venue"] == "all":
+		return "XfD"
+	return WIKIS[search["wiki"]].venues[search["venue"]].name
+
+
+def needsfetch(entry, username, altusername):
+	# Decide from replica metadata whether a page's text is worth downloading.
+	# Nominations are always fetched; otherwise the user must have added at
+	# least VOTE_MIN_BYTES in a single edit to have signed a vote there.
+	firsteditor = entry[1].decode().lower()
+	if firsteditor == username.lower() or firsteditor == altusername.lower():
+		return True
+	return entry[3] is None or int(entry[3]) >= VOTE_MIN_BYTES
+
+
+def findsigner(text):
+	# Matches the last user link in a signed comment, with the name in group 1
+	start = text.rfind("[[User")
+	if start < 0:
+		start = text.rfind("[[user")
+	return VOTER_MATCH_PATTERN.match(text[start:])
+
+
+def parsevote(v, venue):
+	for key, vote in venue.votemap.items():
 		if key in v.lower():
-			return vote
-	return "UNDETERMINED"
+			return vote if vote is None else OUTCOME_CODES[vote]
+	return UNDETERMINED
 
 
 def parsetime(t):
@@ -590,72 +2139,296 @@ def parsetime(t):
 		return f"{tm.group(2)} {tm.group(1)}, {tm.group(3)}"
 
 
-def findresults(thepage):  # Parse through the text of an AfD to find how it was closed
-	resultsearch = RESULT_PATTERN.search(thepage)
+def parseafd(data, page, headonly=False, wiki=DEFAULT_WIKI):
+	# Everything analyze() needs from an AfD's text: the closing statement,
+	# result and DRV notices from parsehead(), and every participant's votes.
+	# Daily logs are parsed by parselog() instead.
+	venue = venueof(page, wiki)
+	if venue.daily is True:
+		return parselog(data, page, venue)
+	data = STRIKE_PATTERN.sub("", data)
+	# We don't want to include the closing statement while finding votes
+	header_index = data.find("==")
+	if headonly is True:
+		votes_data = ""
+	elif header_index > -1:
+		votes_data = data[header_index:]
+	else:
+		votes_data = data
+	result_data, result, deletionreviews = parsehead(data, page, venue)
+	return [result_data, result, deletionreviews, findparticipants(votes_data, venue)]
+
+
+def parselog(data, page, venue):
+	# Every discussion on a daily log page, as [heading, nominator, nomination
+	# date] followed by what parseafd() gives for a page of its own
+	discussions = []
+	parts = LOG_HEADING_PATTERN.split(STRIKE_PATTERN.sub("", data))
+	for heading, text in zip(parts[1::2], parts[2::2]):
+		heading = heading.replace("[[:", "").replace("[[", "").replace("]]", "")
+		result_data, result, deletionreviews = parsehead(text, page, venue)
+		# The nomination is the first signed comment after any close
+		if result != NOT_CLOSED:
+			text = text[len(result_data) + len("(UTC)") :]
+		nomination = text[: text.find("(UTC)") + len("(UTC)")]
+		nominator = findsigner(nomination)
+		nominator = "" if nominator is None else nominator.group(1).strip()
+		timematch = TIME_MATCH_PATTERN.search(nomination)
+		discussions.append(
+			[
+				heading,
+				nominator.replace("_", " "),
+				"" if timematch is None else parsetime(timematch.group(1)),
+				result_data,
+				result,
+				deletionreviews,
+				findparticipants(text, venue),
+			]
+		)
+	return discussions
+
+
+def findparticipants(text, venue):
+	# Every signed, bolded vote in the text as [voter, OUTCOMES code, date], in
+	# page order. Comments and votes whose signature can't be read are left out.
+	participants = []
+	for vote in VOTE_PATTERN.findall(text):
+		votermatch = findsigner(vote)
+		if votermatch is None:
+			continue
+		voter = votermatch.group(1).strip()
+		# Sometimes, a "#top" will sneak in, so remove it
+		if voter.endswith("#top"):
+			voter = voter[:-4]
+		# Underscores are turned into spaces by MediaWiki
+		voter = voter.replace("_", " ")
+		votetype = parsevote(vote[3 : vote.find("'", 3)], venue)
+		if votetype is None:
+			continue
+		timematch = TIME_MATCH_PATTERN.search(vote)
+		votetime = "" if timematch is None else parsetime(timematch.group(1))
+		participants.append([voter, votetype, votetime])
+	return participants
+
+
+def addedvotes(entry, venue, fetchstats=None, deadline=None, wiki=DEFAULT_WIKI):
+	# extract=diff and nomsonly: the votes in the text the user added to an
+	# AfD, which queryDB gives as just the creation for nominations
+	addedtext = APIaddedtext(entry[5], fetchstats, deadline, wiki)
+	addedtext = dropcloses(STRIKE_PATTERN.sub("", addedtext), venue)
+	return findparticipants(addedtext, venue)
+
+
+def addedvotesahead(entries, done, fetchstats=None, deadline=None, wiki=DEFAULT_WIKI):
+	# addedvotes() by page for the first entry, and for those after it that
+	# aren't done already for as long as the deadline allows. Only the first
+	# entry's errors are raised; the others fail again, and are logged, in
+	# their turn.
+	page = entries[0][0].decode()
+	venue = venueof(page, wiki)
+	added = {page: addedvotes(entries[0], venue, fetchstats, deadline, wiki)}
+	for entry in entries[1:]:
+		if deadline is not None and time.time() >= deadline:
+			break
+		page = entry[0].decode()
+		venue = venueof(page, wiki)
+		if page in done or venue.daily is True:
+			continue
+		try:
+			added[page] = addedvotes(entry, venue, fetchstats, deadline, wiki)
+		except Exception:
+			continue
+	return added
+
+
+def dropcloses(text, venue):
+	# Removes closing statements ("The result was '''delete'''." up to the
+	# closer's signature), so that a close isn't read as the closer's vote
+	match = venue.resultpattern.search(text)
+	while match is not None:
+		end = text.find("(UTC)", match.end())
+		end = len(text) if end < 0 else end + len("(UTC)")
+		text = text[: match.start()] + text[end:]
+		match = venue.resultpattern.search(text, match.start())
+	return text
+
+
+def participantnames(parsedafds, wiki=DEFAULT_WIKI):
+	# Every voter in (page, parsed AfD) pairs, to be resolved together
+	names = set()
+	for page, parsedafd in parsedafds:
+		venue = venueof(page, wiki)
+		if venue is not None and venue.daily is True:
+			discussions = [d[3:] for d in parsedafd]
+		else:
+			discussions = [parsedafd]
+		for discussion in discussions:
+			names.update(p[0] for p in discussion[3])
+	return names
+
+
+def parsedkey(page, section, revid):
+	# Parsed AfDs are keyed by revision and by the shape parseafd() gives them
+	return [page, section, revid, PARSED_FORMAT]
+
+
+def cacheparsed(page, section, revid, parsedafd, wiki=DEFAULT_WIKI):
+	value = json.dumps(parsedafd).encode("utf-8")
+	key = parsedkey(page, section, revid)
+	cache.put(wikins(wiki, "parsed"), key, value, PARSED_CACHE_TTL)
+
+
+def parsehead(data, page, venue):
+	# Everything needed from the top of an AfD: the closing statement, the
+	# result, and any DRV notices. Works on the full text or just section 0.
+	header_index = data.find("==")
+	result_data = data[: max(header_index, data.find("(UTC)"))]
+	return (
+		result_data,
+		findresults(result_data, venue),
+		findDRV(data[:header_index], page),
+	)
+
+
+def findresults(
+	thepage, venue
+):  # Parse through the text of an AfD to find how it was closed
+	resultsearch = venue.resultpattern.search(thepage)
 	if resultsearch is None:
-		if (
-			"The following discussion is an archived debate of the proposed deletion of the article below"
-			in thepage
-			or "This page is an archive of the proposed deletion of the article below."
-			in thepage
-			or "'''This page is no longer live.'''" in thepage
-		):
-			return "UNDETERMINED"
-		return "Not closed yet"
-	for key, result in RESULT_MAP.items():
+		if any(archived in thepage for archived in venue.archived):
+			return UNDETERMINED
+		return NOT_CLOSED
+	for key, result in venue.resultmap.items():
 		if key in resultsearch.group(1).lower():
-			return result
-	return "UNDETERMINED"
+			return OUTCOME_CODES[result]
+	return UNDETERMINED
 
 
 def findDRV(thepage, pagename):
-	# Try to find evidence of a DRV that was opened on this AfD
+	# Try to find evidence of a DRV that was opened on this AfD, as [log date,
+	# page] for each one
 	try:
-		drvs = ""
-		drvcounter = 0
-		baseurl = f"{WIKI_URL}/wiki/Wikipedia:Deletion_review/Log/"
+		drvs = []
 		for drv in DRV_PATTERN.finditer(thepage):
 			drvdate = DRV_DATE_PATTERN.search(drv.group(1))
 			if drvdate:
-				drvcounter += 1
 				name = DRV_NAME_PATTERN.search(drv.group(1))
 				if name:
-					nametext = urllib.parse.quote(name.group(1))
+					nametext = name.group(1)
 				else:
-					nametext = urllib.parse.quote(
-						pagename.replace("Articles_for_deletion/", "", 1)
-					)
-				drvs += '<a href="{}{}#{}"><sup><small>[{}]</small></sup></a>'.format(
-					baseurl,
-					drvdate.group(1).strip().replace(" ", "_"),
-					nametext,
-					drvcounter,
-				)
+					nametext = pagename.replace("Articles_for_deletion/", "", 1)
+				drvs.append([drvdate.group(1).strip(), nametext])
 		return drvs
 	except Exception:
-		return ""
+		return []
+
+
+def drvlinks(drvs, wiki):
+	# Numbered links to the deletion review logs that findDRV() found
+	baseurl = f"{wiki.url}/wiki/Wikipedia:Deletion_review/Log/"
+	return "".join(
+		'<a href="{}{}#{}"><sup><small>[{}]</small></sup></a>'.format(
+			baseurl, date.replace(" ", "_"), urllib.parse.quote(name), n
+		)
+		for n, (date, name) in enumerate(drvs, 1)
+	)
+
+
+def updatestats(votecounts, matrix, record):  # Update the counts for a vote
+	votecounts[record.vote] += 1
+	if record.vote < len(VOTE_TYPES) and record.result < len(RESULT_TYPES):
+		matrix[record.vote * len(RESULT_TYPES) + record.result] += 1
+
 
+def newtrendbucket():
+	# Votes per OUTCOMES code, matchstats as in render(), and the match rate
+	return {
+		"votecounts": [0] * len(OUTCOMES),
+		"matchstats": [0, 0, 0],
+		"matchrate": None,
+	}
 
-def updatestats(stats, v, r):  # Update the stats variable for votes
-	if v in VOTE_TYPES:
-		vv = STATS_VOTES[VOTE_TYPES.index(v)]
+
+def updatetrend(bucket, outcomes, page, revid, records, novotes):
+	# Adds what analyze() made of a page to its period's bucket, and notes it
+	# as the page's cacheable outcome at that revision. Every page analyzed
+	# ends up with a vote or in the no-vote list, so one with neither failed
+	# and gets None, as does one whose result may yet change.
+	unsettled = any(r.result in (NOT_CLOSED, UNDETERMINED) for r in records)
+	if unsettled or not (records or novotes):
+		outcomes[page] = None
 	else:
-		if ("UNDETERMINED" in stats) and (v == "UNDETERMINED"):
-			stats["UNDETERMINED"] += 1
-		return
-	stats[v] += 1
-	if r in RESULT_TYPES:
-		rr = STATS_RESULTS[RESULT_TYPES.index(r)]
+		outcomes[page] = [records, novotes, revid]
+	for record in records:
+		bucket["votecounts"][record.vote] += 1
+		match = MATCH_CLASSES[record.vote * len(OUTCOMES) + record.result]
+		if match is not None:
+			bucket["matchstats"][match] += 1
+	matches, nonmatches = bucket["matchstats"][:2]
+	if matches + nonmatches > 0:
+		bucket["matchrate"] = matches / (matches + nonmatches)
+
+
+def trendperiod(timestamp, trend):
+	# "YYYY-MM" or "YYYY-Qn" for a replica timestamp
+	timestamp = timestamp.decode() if isinstance(timestamp, bytes) else timestamp
+	if trend == "quarter":
+		return f"{timestamp[:4]}-Q{(int(timestamp[4:6]) - 1) // 3 + 1}"
+	return f"{timestamp[:4]}-{timestamp[4:6]}"
+
+
+def periodbounds(period):
+	# First and last second of a trendperiod(), as replica timestamps
+	year, part = period.split("-")
+	if part.startswith("Q"):
+		first, months = (int(part[1:]) - 1) * 3 + 1, 3
 	else:
-		return
-	stats[vv + rr] += 1
+		first, months = int(part), 1
+	end = datetime.datetime(
+		int(year) + (first + months - 1) // 12, (first + months - 1) % 12 + 1, 1
+	)
+	end -= datetime.timedelta(seconds=1)
+	return f"{year}{first:02d}01000000", end.strftime("%Y%m%d%H%M%S")
+
+
+def periodsettled(period):
+	settled = time.gmtime(time.time() - TREND_SETTLE)
+	return periodbounds(period)[1] < time.strftime("%Y%m%d%H%M%S", settled)
+
+
+def trendkey(search, period):
+	# Everything that decides an AfD's outcome in analyze(), bar the AfD
+	return [
+		search["username"],
+		search["altusername"],
+		search["nomsonly"],
+		search["undetermined"],
+		search["extractdiff"],
+		period,
+	]
 
 
-def afdrow(matchstats, i):  # Update the matchstats variable and generate table row
-	v, r, drv = i[1], i[3], i[5]
+def afdrow(
+	matchstats, i, wiki
+):  # Update the matchstats variable and generate table row
 	c = "m"
+	match = MATCH_CLASSES[i.vote * len(OUTCOMES) + i.result]
+	if match is not None:
+		matchstats[match] += 1
+		c = "ynm"[match]
+	return f"""<tr>
+	<td>{link(i.page, wiki)}</td>
+	<td>{i.votetime}</td>
+	<td>{OUTCOMES[i.vote]}{" (Nom)" if i.nom == 1 else ""}</td>
+	<td class="{c}">{OUTCOMES[i.result]}{drvlinks(i.drv, wiki)}</td>
+</tr>"""
+
+
+def matchclass(v, r):
+	# Index into matchstats for a vote and result: 0 for a match, 1 for a
+	# non-match, 2 for No Consensus, or None if it can't be judged yet
 	if r == "No Consensus":
-		matchstats[2] += 1
+		return 2
 	elif (
 		v == r
 		or ((v in ["Speedy Keep", "Keep"]) and (r in ["Speedy Keep", "Keep"]))
@@ -663,112 +2436,245 @@ def afdrow(matchstats, i):  # Update the matchstats variable and generate table
 		or ((v in ["Redirect", "Delete"]) and (r in ["Redirect", "Delete"]))
 		or ((v in ["Redirect", "Merge"]) and (r in ["Redirect", "Merge"]))
 	):
-		matchstats[0] += 1
-		c = "y"
+		return 0
 	elif r != "Not closed yet" and r != "UNDETERMINED" and v != "UNDETERMINED":
-		matchstats[1] += 1
-		c = "n"
-	return f"""<tr>
-	<td>{link(i[0])}</td>
-	<td>{i[2]}</td>
-	<td>{v}{" (Nom)" if i[4] == 1 else ""}</td>
-	<td class="{c}">{r}{drv}</td>
-</tr>"""
+		return 1
+	return None
+
 
+# matchclass for every pair of OUTCOMES codes, at [vote * len(OUTCOMES) + result]
+MATCH_CLASSES = [matchclass(v, r) for v in OUTCOMES for r in OUTCOMES]
 
-def matrixmatch(stats, v, r):
+
+def matrixmatch(cell, v, r):
 	# Returns html to color the cell of the matrix table correctly,
 	# depending on whether there is a match/non-match (red/green),
 	# or if the cell is zero/non-zero (bright/dull).
-	if stats[v + r]:
-		if r == "nc":
-			return '<td class="mm">'
-		elif (
-			v == r
-			or (v == "sk" and r == "k")
-			or (v == "k" and r == "sk")
-			or (v == "d" and r == "sd")
-			or (v == "sd" and r == "d")
-			or (v == "d" and r == "r")
-			or (v == "r" and r == "d")
-			or (v == "m" and r == "r")
-			or (v == "r" and r == "m")
-		):
-			return '<td class="yy">'
+	c = "ynm"[MATCH_CLASSES[v * len(OUTCOMES) + r]] * 2
+	if not cell:
+		c += c[0]
+	return f'<td class="{c}">'
+
+
+def APIget(params, fetchstats=None, deadline=None, wiki=DEFAULT_WIKI):
+	# Performs one API request and returns the decoded JSON. Replication lag,
+	# throttling and server errors are retried with jittered exponential
+	# backoff, or after the server's Retry-After if it sent one, as long as
+	# that doesn't run past the deadline.
+	params = dict(params, format="json", formatversion=2, maxlag=API_MAXLAG)
+	path = urllib.parse.urlsplit(wiki.api).path + "?" + urllib.parse.urlencode(params)
+	for attempt in range(API_RETRIES + 1):
+		try:
+			status, raw, retryafter = apirequest(path, deadline, wiki)
+		except (OSError, http.client.HTTPException):
+			if attempt == API_RETRIES:
+				raise
+			retryafter = None
 		else:
-			return '<td class="nn">'
+			if status != 200:
+				retry = status in (429, 500, 502, 503, 504)
+				if not retry or attempt == API_RETRIES:
+					raise IOError(f"API returned HTTP {status}")
+			else:
+				if fetchstats is not None:
+					fetchstats[0] += 1
+					fetchstats[1] += len(raw)
+				data = json.loads(raw)
+				error = data.get("error")
+				if error is None:
+					return data
+				if error.get("code") != "maxlag" or attempt == API_RETRIES:
+					raise IOError(f"API error {error.get('code')}: {error.get('info')}")
+		delay = backoff(attempt, retryafter)
+		if deadline is not None and time.time() + delay > deadline:
+			raise TimeoutError("Out of time waiting to retry the API")
+		time.sleep(delay)
+
+
+def apirequest(path, deadline=None, wiki=DEFAULT_WIKI):
+	# Sends one GET to the wiki's API, returning the status, the body and any
+	# Retry-After header
+	timeout = None if deadline is None else max(1, deadline - time.time())
+	connection = apiconnection(wiki)
+	reused = connection.sock is not None
+	try:
+		connection.timeout = timeout
+		if reused:
+			connection.sock.settimeout(timeout)
+		connection.request("GET", path, headers={"User-Agent": USER_AGENT})
+		response = connection.getresponse()
+		raw = response.read()
+	except (ConnectionResetError, BrokenPipeError):
+		# The API closes keep-alive connections that sit idle, which shows up
+		# as RemoteDisconnected or a broken pipe on the next request. That's
+		# not worth a backoff, so a reused connection is reopened and tried
+		# again once, straight away.
+		connection.close()
+		if not reused:
+			raise
+		return apirequest(path, deadline, wiki)
+	except (OSError, http.client.HTTPException):
+		connection.close()
+		raise
+	pool = apipools.setdefault(wiki.name, [])
+	if len(pool) < API_POOL_SIZE:
+		pool.append(connection)
 	else:
-		if r == "nc":
-			return '<td class="mmm">'
-		elif (
-			v == r
-			or (v == "sk" and r == "k")
-			or (v == "k" and r == "sk")
-			or (v == "d" and r == "sd")
-			or (v == "sd" and r == "d")
-			or (v == "d" and r == "r")
-			or (v == "r" and r == "d")
-			or (v == "m" and r == "r")
-			or (v == "r" and r == "m")
-		):
-			return '<td class="yyy">'
-		else:
-			return '<td class="nnn">'
+		connection.close()
+	return response.status, raw, response.getheader("Retry-After")
 
 
-def APIpagedata(rawpagelist):  # Grabs page text for all of the AfDs using the API
+def apiconnection(wiki):
+	# A keep-alive connection to the wiki's API from its pool, or a new one.
+	# Searches run in threads of their own (format=events, scgiserver.py), so
+	# connections are shared by the process rather than kept per thread.
 	try:
-		p = ""
-		for page in rawpagelist:
-			if page[0]:
-				p += urllib.parse.quote(
-					f"Wikipedia:{page[0].decode().replace('_', ' ')}|"
-				)
-		u = urlopen(
-			WIKI_URL
-			+ "w/api.php"
-			+ "?action=query&prop=revisions|info&rvprop=content&format=xml&titles="
-			+ p[:-3]
-		)
-		xml = u.read()
-		u.close()
-		pagelist = PAGE_LIST_PATTERN.findall(xml.decode())
+		return apipools.setdefault(wiki.name, []).pop()
+	except IndexError:
+		return http.client.HTTPSConnection(urllib.parse.urlsplit(wiki.api).netloc)
+
+
+def backoff(attempt, retryafter=None):
+	try:
+		delay = max(float(retryafter), API_BACKOFF)
+	except (TypeError, ValueError):
+		delay = API_BACKOFF * 2**attempt
+	return delay + random.uniform(0, delay / 2)
+
+
+def APIpagedata(
+	rawpagelist, section=None, fetchstats=None, deadline=None, wiki=DEFAULT_WIKI
+):
+	# Grabs page text for all of the AfDs using the API, yielding the page names
+	# and texts of one batch at a time so callers can stop early. Texts are
+	# cached compressed (textzip.py) by revision, so only pages edited since
+	# they were last seen are requested. Batches are sized by the replica's page_len so responses fit
+	# under the API's result size limit, and the byte budget is halved whenever
+	# a response still had to be continued. Continuations are followed so no
+	# page is dropped.
+	maxbytes = API_MAX_BYTES
+	i = 0
+	while i < len(rawpagelist):
+		batch = []
+		fetch = []
 		pagedict = {}
-		for i in pagelist:
-			try:
-				pagename = PAGE_NAME_PATTERN.search(i).group(1)
-				text = PAGE_TEXT_PATTERN.search(i).group(1)
-				if PAGE_REDIRECT_PATTERN.search(i):  # AfD page is a redirect
-					continue
-				pagedict[html.unescape(pagename)] = text
-			except Exception:
+		size = 0
+		while i < len(rawpagelist) and len(fetch) < API_MAX_TITLES:
+			entry = rawpagelist[i]
+			if not entry[0]:
+				i += 1
 				continue
-		return pagedict
-	except Exception as err:
-		return f"Unable to fetch page data. Please try again.<!--{err}-->"
+			page = entry[0].decode()
+			title = f"Wikipedia:{page}".replace("_", " ")
+			text = cache.get(wikins(wiki, "text"), [title, section, int(entry[8])])
+			if text is not None:
+				text = textzip.unpack(text)
+			if text is None:
+				pagelen = 0 if section is not None else int(entry[4] or 0)
+				if fetch and size + pagelen > maxbytes:
+					break
+				fetch.append(title)
+				size += pagelen
+			else:
+				pagedict[title] = text
+			batch.append(page)
+			i += 1
+		params = {
+			"action": "query",
+			"prop": "revisions|info",
+			"rvprop": "content|ids",
+			"rvslots": "main",
+			"titles": "|".join(fetch),
+		}
+		if section is not None:
+			params["rvsection"] = section
+		while fetch:
+			data = APIget(params, fetchstats, deadline, wiki)
+			for page in data.get("query", {}).get("pages", []):
+				if page.get("redirect") or "revisions" not in page:
+					continue  # AfD page is a redirect, or continued below
+				revision = page["revisions"][0]
+				text = revision["slots"]["main"]["content"]
+				pagedict[page["title"]] = text
+				cache.put(
+					wikins(wiki, "text"),
+					[page["title"], section, revision["revid"]],
+					textzip.pack(text),
+					PAGE_CACHE_TTL,
+				)
+			if "continue" not in data:
+				break
+			params.update(data["continue"])
+			maxbytes = max(maxbytes // 2, 1)
+		yield batch, pagedict
 
 
-def datefmt(datestr):
-	try:
-		tg = DATE_TG_PATTERN.search(datestr)
-		if tg is None:
-			return ""
-		month = [k for k, v in MONTH_MAP.items() if v == tg.group(1)][0]
-		day = tg.group(2)
-		year = tg.group(3)
-		if len(day) == 1:
-			day = "0" + day
-		return year + month + day
-	except Exception:
-		return ""
+def APIaddedtext(revpairs, fetchstats=None, deadline=None, wiki=DEFAULT_WIKI):
+	# Returns the wikitext a user added to a page, oldest edit first, given the
+	# "parent:revision:delta" list from queryDB, which is oldest first so that
+	# a truncated list loses the user's latest edits rather than their vote.
+	# Edits too small to contain a signed vote are never requested.
+	if isinstance(revpairs, bytes):
+		revpairs = revpairs.decode()
+	added = []
+	for pair in (revpairs or "").split():
+		try:
+			parent, rev, delta = (int(n) for n in pair.split(":"))
+		except ValueError:  # GROUP_CONCAT output can be truncated
+			continue
+		if delta < VOTE_MIN_BYTES:
+			continue
+		try:
+			if parent == 0:  # page creation, so everything was added
+				data = APIget(
+					{
+						"action": "query",
+						"prop": "revisions",
+						"revids": rev,
+						"rvprop": "content",
+						"rvslots": "main",
+					},
+					fetchstats,
+					deadline,
+					wiki,
+				)
+				revision = data["query"]["pages"][0]["revisions"][0]
+				added.append(revision["slots"]["main"]["content"])
+			else:
+				data = APIget(
+					{
+						"action": "compare",
+						"fromrev": parent,
+						"torev": rev,
+						"prop": "diff",
+					},
+					fetchstats,
+					deadline,
+					wiki,
+				)
+				for line in DIFF_ADDED_PATTERN.findall(data["compare"]["body"]):
+					added.append(html.unescape(HTML_TAG_PATTERN.sub("", line)))
+		except Exception:
+			continue
+	return "\n".join(added)
 
 
-def link(p):
-	text = html.escape(p.replace("_", " ")[22:])
+def link(p, wiki=DEFAULT_WIKI):
+	# Discussions on daily logs are shown by their section heading
+	text = p.replace("_", " ")[len(venueof(p, wiki).prefix) :].split("#")[-1]
+	text = html.escape(text)
 	if len(text) > 64:
 		text = f"{text[:61]}..."
-	return '<a href="{}wiki/Wikipedia:{}">{}</a>'.format(
-		WIKI_URL, urllib.parse.quote(p), text
+	page, hash, anchor = p.partition("#")
+	url = urllib.parse.quote(page)
+	if hash:
+		url += "#" + urllib.parse.quote(anchor.replace(" ", "_"), safe=":")
+	return f'<a href="{wiki.url}wiki/Wikipedia:{url}">{text}</a>'
+
+
+def novoteitem(page, closer="", wiki=DEFAULT_WIKI):
+	return "<li><a href = '{}wiki/Wikipedia:{}'>{}</a>{}</li>".format(
+		wiki.url, urllib.parse.quote(page), page, closer
 	)
 
 
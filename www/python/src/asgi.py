@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+# ASGI entry point, serving the same searches as the uWSGI app from one
+# process under an async server, e.g.
+#   uvicorn --app-dir www/python/src asgi:application
+# This is a thread-pool server, not an async one: every request runs
+# app.app() in one of ASGI_THREADS worker threads, blocking replica queries
+# and API requests included, so at most ASGI_THREADS searches run at once per
+# process and the event loop only moves bytes to and from clients. A thread
+# costs far less memory than a uWSGI worker, so more of them fit in the same
+# memory. Replica connections stay within app.DB_MAX_CONNECTIONS however many
+# threads there are. A search spends most of its time on API requests and
+# holds a connection for a few queries only, so there are many threads to
+# each connection.
+
+import asyncio
+import concurrent.futures
+import io
+import sys
+
+import app
+
+ASGI_THREADS = 16 * app.DB_MAX_CONNECTIONS
+
+executor = concurrent.futures.ThreadPoolExecutor(ASGI_THREADS)
+
+
+async def application(scope, receive, send):
+	if scope["type"] == "lifespan":
+		return await lifespan(receive, send)
+	if scope["type"] != "http":
+		return
+	environ = {
+		"REQUEST_METHOD": scope["method"],
+		"SCRIPT_NAME": scope.get("root_path", ""),
+		"PATH_INFO": scope["path"],
+		"QUERY_STRING": scope["query_string"].decode("latin-1"),
+		"SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+		"wsgi.version": (1, 0),
+		"wsgi.url_scheme": scope.get("scheme", "http"),
+		"wsgi.input": io.BytesIO(),
+		"wsgi.errors": sys.stderr,
+		"wsgi.multithread": True,
+		"wsgi.multiprocess": False,
+		"wsgi.run_once": False,
+	}
+	response = []
+
+	def start_response(status, headers, exc_info=None):
+		response[:] = [status, headers]
+
+	# Generators (format=events and csv) only call start_response once their
+	# first chunk is asked for
+	loop = asyncio.get_running_loop()
+
+	def inthread(fn, *args):
+		return loop.run_in_executor(executor, fn, *args)
+
+	chunks = await inthread(app.app, environ, start_response)
+	try:
+		iterator = iter(chunks)
+		done = object()
+		chunk = await inthread(next, iterator, done)
+		status, headers = response
+		await send(
+			{
+				"type": "http.response.start",
+				"status": int(status.split()[0]),
+				"headers": [
+					(name.lower().encode("latin-1"), value.encode("latin-1"))
+					for name, value in headers
+				],
+			}
+		)
+		while chunk is not done:
+			await send({"type": "http.response.body", "body": chunk, "more_body": True})
+			chunk = await inthread(next, iterator, done)
+		await send({"type": "http.response.body", "body": b""})
+	finally:
+		if hasattr(chunks, "close"):
+			await inthread(chunks.close)
+
+
+async def lifespan(receive, send):
+	while True:
+		message = await receive()
+		if message["type"] == "lifespan.startup":
+			await send({"type": "lifespan.startup.complete"})
+		elif message["type"] == "lifespan.shutdown":
+			executor.shutdown(wait=False)
+			await send({"type": "lifespan.shutdown.complete"})
+			return
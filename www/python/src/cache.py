@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+# Cache shared by everything that runs a search. Under uWSGI, entries live in
+# the "afdstats" cache2 declared in uwsgi.ini: shared memory, so all workers on
+# the node see the same entries, with one LRU and one set of hit counters, and
+# nothing is lost when a worker is recycled. Anywhere else (the job worker,
+# scripts, local runs) entries are files under CACHE_DIR, and the webservice
+# reads through to those files on a miss, so things cached by the worker and
+# the scripts reach it too. Only the namespaces in READ_THROUGH are read
+# through, as CACHE_DIR is on NFS and most misses are for things no other
+# process writes.
+#
+# Keys are a namespace plus any JSON-able value; values are bytes.
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+try:
+	import uwsgi
+except ImportError:
+	uwsgi = None
+
+CACHE_NAME = "afdstats"
+CACHE_DIR = os.path.expanduser("~/afdstats-cache")
+# The file fallback is pruned back to this size, least recently used first,
+# on roughly one write in FILE_PRUNE_ODDS
+FILE_CACHE_BYTES = 512 * 1024 * 1024
+FILE_PRUNE_ODDS = 200
+STATS = ["hits", "misses", "writes"]
+# Namespaces written by processes outside uWSGI (per-wiki namespaces, like
+# "simplewiki-text", end in these too)
+READ_THROUGH = ["text", "parsed", "response"]
+
+if uwsgi is not None and "cache2" not in uwsgi.opt:
+	uwsgi = None
+filestats = dict.fromkeys(STATS, 0)
+
+
+def backend():
+	return "uwsgi" if uwsgi is not None else "file"
+
+
+def cachekey(namespace, key):
+	raw = json.dumps(key, sort_keys=True, separators=(",", ":")).encode("utf-8")
+	return f"{namespace}:{hashlib.sha1(raw).hexdigest()}"
+
+
+def count(stat):
+	if uwsgi is not None:
+		uwsgi.cache_inc(f"stats:{stat}", 1, 0, CACHE_NAME)
+	else:
+		filestats[stat] += 1
+
+
+def get(namespace, key):
+	# Returns the cached value, or None if it is missing or expired
+	readthrough = namespace.rpartition("-")[2] in READ_THROUGH
+	key = cachekey(namespace, key)
+	value = None
+	if uwsgi is not None:
+		value = uwsgi.cache_get(key, CACHE_NAME)
+	if value is None and (uwsgi is None or readthrough):
+		value, expires = fileget(key)
+		if uwsgi is not None and value is not None:
+			uwsgi.cache_update(
+				key, value, max(1, int(expires - time.time())), CACHE_NAME
+			)
+	count("misses" if value is None else "hits")
+	return value
+
+
+def put(namespace, key, value, ttl):
+	key = cachekey(namespace, key)
+	if uwsgi is not None:
+		uwsgi.cache_update(key, value, int(ttl), CACHE_NAME)
+	else:
+		fileput(key, value, ttl)
+	count("writes")
+
+
+def delete(namespace, key):
+	key = cachekey(namespace, key)
+	if uwsgi is not None:
+		uwsgi.cache_del(key, CACHE_NAME)
+	try:
+		os.remove(filepath(key))
+	except FileNotFoundError:
+		pass
+
+
+def stats():
+	# Hit, miss and write counts since the cache was created (or, for the
+	# file fallback, since this process started)
+	if uwsgi is None:
+		return dict(filestats)
+	result = {}
+	for stat in STATS:
+		raw = uwsgi.cache_get(f"stats:{stat}", CACHE_NAME)
+		result[stat] = int.from_bytes(raw, "little") if raw else 0
+	return result
+
+
+def filepath(key):
+	namespace, digest = key.split(":")
+	return os.path.join(CACHE_DIR, namespace, digest)
+
+
+def fileget(key):
+	# Returns the value and when it expires, or None and 0
+	path = filepath(key)
+	try:
+		with open(path, "rb") as f:
+			expires = float(f.readline())
+			value = f.read()
+	except (OSError, ValueError):
+		return None, 0
+	if expires < time.time():
+		try:
+			os.remove(path)
+		except OSError:
+			pass
+		return None, 0
+	try:
+		os.utime(path)  # recently used, for pruning
+	except OSError:
+		pass
+	return value, expires
+
+
+def fileput(key, value, ttl):
+	path = filepath(key)
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+	with open(tmp, "wb") as f:
+		f.write(f"{time.time() + ttl}\n".encode())
+		f.write(value)
+	os.replace(tmp, path)
+	if random.randrange(FILE_PRUNE_ODDS) == 0:
+		fileprune()
+
+
+def fileprune():
+	entries = []
+	for namespace in os.listdir(CACHE_DIR):
+		for name in os.listdir(os.path.join(CACHE_DIR, namespace)):
+			try:
+				st = os.stat(os.path.join(CACHE_DIR, namespace, name))
+			except OSError:
+				continue
+			entries.append((st.st_mtime, st.st_size, namespace, name))
+	size = sum(entry[1] for entry in entries)
+	for mtime, entrysize, namespace, name in sorted(entries):
+		if size <= FILE_CACHE_BYTES:
+			break
+		try:
+			os.remove(os.path.join(CACHE_DIR, namespace, name))
+		except OSError:
+			pass
+		size -= entrysize
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+# Exports the results tables of many searches at once, for research, in
+# columnar form: a row per AfD with the username and the columns of
+# format=csv, votes and results dictionary-encoded against OUTCOMES and vote
+# dates as dates. Output is Parquet, or an Arrow IPC stream with --arrow.
+# Analyses are read one at a time and written out in row groups of
+# ROW_GROUP_ROWS, so memory stays flat however many go in. Needs pyarrow.
+#
+#   python export.py OUT users USERLIST [--max N | --all]
+#       runs a search for every username in USERLIST (one per line, "-"
+#       for stdin)
+#   python export.py OUT jobs
+#       exports every finished background job (job=1) in JOB_DIR
+
+import argparse
+import datetime
+import os
+import sys
+
+try:
+	import pyarrow
+	import pyarrow.ipc
+	import pyarrow.parquet
+except ImportError:
+	pyarrow = None
+
+from app import (
+	JOB_DIR,
+	MATCH_NAMES,
+	OUTCOME_CODES,
+	OUTCOMES,
+	analyze,
+	exportrows,
+	loadjob,
+	parsesearch,
+)
+
+ROW_GROUP_ROWS = 64 * 1024
+
+
+def schema():
+	outcome = pyarrow.dictionary(pyarrow.int8(), pyarrow.string())
+	return pyarrow.schema(
+		[
+			("username", pyarrow.string()),
+			("page", pyarrow.string()),
+			("vote_date", pyarrow.date32()),
+			("vote", outcome),
+			("nom", pyarrow.bool_()),
+			("result", outcome),
+			("match", outcome),
+			("drv_count", pyarrow.int16()),
+		]
+	)
+
+
+def parsedate(votetime):
+	try:
+		return datetime.datetime.strptime(votetime, "%B %d, %Y").date()
+	except ValueError:
+		return None
+
+
+def encoded(values, dictionary, codes):
+	# Every batch shares the same dictionary, so they can go in one stream
+	indices = pyarrow.array([codes.get(v) for v in values], pyarrow.int8())
+	return pyarrow.DictionaryArray.from_arrays(indices, dictionary)
+
+
+def tobatch(username, rows):
+	page, votetime, vote, nom, result, match, drvs = zip(*rows)
+	outcomes = pyarrow.array(OUTCOMES, pyarrow.string())
+	matches = pyarrow.array(MATCH_NAMES, pyarrow.string())
+	matchcodes = {name: code for code, name in enumerate(MATCH_NAMES)}
+	return pyarrow.record_batch(
+		[
+			pyarrow.array([username] * len(page), pyarrow.string()),
+			pyarrow.array(page, pyarrow.string()),
+			pyarrow.array([parsedate(t) for t in votetime], pyarrow.date32()),
+			encoded(vote, outcomes, OUTCOME_CODES),
+			pyarrow.array([n == 1 for n in nom], pyarrow.bool_()),
+			encoded(result, outcomes, OUTCOME_CODES),
+			encoded(match, matches, matchcodes),
+			pyarrow.array(drvs, pyarrow.int16()),
+		],
+		schema=schema(),
+	)
+
+
+def useranalyses(path, maxsearch):
+	# (username, analysis) for every user in the list, searched in turn
+	f = sys.stdin if path == "-" else open(path, encoding="utf-8")
+	for line in f:
+		search = parsesearch({"name": [line.strip()]})
+		if search is None:
+			continue
+		search["maxsearch"] = maxsearch
+		yield search["username"], analyze(search)
+
+
+def jobanalyses():
+	for name in sorted(os.listdir(JOB_DIR)):
+		if not name.endswith(".json"):
+			continue
+		job = loadjob(name[: -len(".json")])
+		if job is not None and job["status"] == "done":
+			yield job["search"]["username"], job["analysis"]
+
+
+def export(analyses, out, arrow=False):
+	if arrow is True:
+		writer = pyarrow.ipc.new_stream(out, schema())
+	else:
+		writer = pyarrow.parquet.ParquetWriter(out, schema())
+	pending = []
+	users = 0
+	rows = 0
+	with writer:
+		for username, analysis in analyses:
+			if isinstance(analysis, str):
+				print(f"{username}: {analysis}", file=sys.stderr)
+				continue
+			users += 1
+			batch = list(exportrows(analysis))
+			if not batch:
+				continue
+			pending.append(tobatch(username, batch))
+			rows += len(batch)
+			if sum(b.num_rows for b in pending) >= ROW_GROUP_ROWS:
+				writer.write_table(pyarrow.Table.from_batches(pending))
+				pending = []
+		if pending:
+			writer.write_table(pyarrow.Table.from_batches(pending))
+	print(f"Wrote {rows} rows for {users} users to {out}")
+
+
+def main(args):
+	parser = argparse.ArgumentParser(description="Export afdstats results")
+	parser.add_argument("out", help="output file")
+	parser.add_argument("source", choices=["users", "jobs"])
+	parser.add_argument("userlist", nargs="?", help="file of usernames")
+	parser.add_argument("--max", type=int, default=200)
+	parser.add_argument("--all", action="store_true", help="whole histories")
+	parser.add_argument("--arrow", action="store_true", help="write Arrow IPC")
+	args = parser.parse_args(args)
+	if pyarrow is None:
+		print("export.py needs pyarrow (pip install pyarrow)", file=sys.stderr)
+		return 1
+	if args.source == "users":
+		if args.userlist is None:
+			parser.error("users needs a file of usernames")
+		analyses = useranalyses(args.userlist, None if args.all else args.max)
+	else:
+		analyses = jobanalyses()
+	export(analyses, args.out, args.arrow)
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+# Background worker for full-history analysis jobs queued by app.py with
+# job=1. Run a single instance as a continuous Toolforge job alongside the
+# webservice, e.g.
+#   toolforge jobs run afdstats-worker --continuous --image python3.11 \
+#     --command "pyvenv/bin/python www/python/src/jobworker.py"
+
+import os
+import time
+
+from app import JOB_DIR, JOB_TTL, loadjob, runjob
+
+POLL_INTERVAL = 5
+EXPIRE_INTERVAL = 3600
+
+
+def queuedat(queue, jobid):
+	try:
+		return os.path.getmtime(os.path.join(queue, jobid))
+	except OSError:
+		return 0
+
+
+def expirejobs():
+	# Finished jobs are kept for JOB_TTL, after which a resubmission runs the
+	# search again anyway
+	for name in os.listdir(JOB_DIR):
+		if not name.endswith(".json"):
+			continue
+		job = loadjob(name[: -len(".json")])
+		if (
+			job is not None
+			and job["status"] in ("done", "failed")
+			and job["updated"] < time.time() - JOB_TTL
+		):
+			try:
+				os.remove(os.path.join(JOB_DIR, name))
+			except FileNotFoundError:
+				pass
+
+
+def main():
+	queue = os.path.join(JOB_DIR, "queue")
+	running = os.path.join(JOB_DIR, "running")
+	os.makedirs(queue, exist_ok=True)
+	os.makedirs(running, exist_ok=True)
+
+	# Jobs left behind by a worker that died are picked up again
+	for jobid in os.listdir(running):
+		os.replace(os.path.join(running, jobid), os.path.join(queue, jobid))
+
+	lastexpired = 0
+	while True:
+		if time.time() - lastexpired >= EXPIRE_INTERVAL:
+			expirejobs()
+			lastexpired = time.time()
+		for jobid in sorted(os.listdir(queue), key=lambda j: queuedat(queue, j)):
+			try:
+				os.rename(os.path.join(queue, jobid), os.path.join(running, jobid))
+			except FileNotFoundError:
+				continue
+			runjob(jobid)
+			os.remove(os.path.join(running, jobid))
+		time.sleep(POLL_INTERVAL)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+# Load test for comparing the uWSGI app with the ASGI one (asgi.py). Keeps
+# CONCURRENCY searches in flight against a running server for DURATION
+# seconds and reports throughput and latency, along with the peak memory of
+# the server's processes if their pids are given, so the two setups can be
+# compared at equal memory:
+#
+#   python loadtest.py URL SEARCHES [--concurrency N] [--duration S]
+#                      [--pids PID,...]
+#
+# URL is the app's address (e.g. http://localhost:8000/afdstats.py) and
+# SEARCHES a file of query strings, or of bare usernames, one per line, which
+# are sent round-robin. For uWSGI, pass the master and every worker:
+#   --pids $(pgrep -d, -f uwsgi)
+
+import argparse
+import itertools
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+MEMORY_INTERVAL = 0.5
+
+
+def readsearches(path):
+	searches = []
+	with open(path, encoding="utf-8") as f:
+		for line in f:
+			line = line.strip()
+			if not line:
+				continue
+			if "=" not in line:
+				line = "name=" + urllib.parse.quote(line)
+			searches.append(line)
+	return searches
+
+
+def rss(pid):
+	# Resident memory of a process in bytes, or 0 if it has gone away
+	try:
+		with open(f"/proc/{pid}/status") as f:
+			for line in f:
+				if line.startswith("VmRSS:"):
+					return int(line.split()[1]) * 1024
+	except OSError:
+		pass
+	return 0
+
+
+def watchmemory(pids, stop, peak):
+	while not stop.is_set():
+		peak[0] = max(peak[0], sum(rss(pid) for pid in pids))
+		stop.wait(MEMORY_INTERVAL)
+
+
+def worker(url, searches, until, results, lock):
+	while time.time() < until:
+		with lock:
+			query = next(searches)
+		start = time.time()
+		try:
+			with urllib.request.urlopen(f"{url}?{query}") as response:
+				response.read()
+				ok = response.status == 200
+		except Exception:
+			ok = False
+		with lock:
+			results.append((ok, time.time() - start))
+
+
+def percentile(values, fraction):
+	return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main(args):
+	parser = argparse.ArgumentParser(description="Load test afdstats")
+	parser.add_argument("url")
+	parser.add_argument("searches", help="file of query strings or usernames")
+	parser.add_argument("--concurrency", type=int, default=32)
+	parser.add_argument("--duration", type=float, default=60)
+	parser.add_argument("--pids", default="", help="server pids, comma-separated")
+	args = parser.parse_args(args)
+	searches = itertools.cycle(readsearches(args.searches))
+	pids = [int(pid) for pid in args.pids.split(",") if pid]
+	results = []
+	lock = threading.Lock()
+	stop = threading.Event()
+	peak = [0]
+	memory = threading.Thread(target=watchmemory, args=(pids, stop, peak))
+	memory.start()
+	start = time.time()
+	until = start + args.duration
+	threads = [
+		threading.Thread(target=worker, args=(args.url, searches, until, results, lock))
+		for i in range(args.concurrency)
+	]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	elapsed = time.time() - start
+	stop.set()
+	memory.join()
+
+	latencies = sorted(latency for ok, latency in results if ok)
+	failed = len(results) - len(latencies)
+	print(f"{len(results)} requests in {elapsed:.1f} s, {failed} failed")
+	if latencies:
+		print(f"Throughput: {len(latencies) / elapsed:.2f} searches/s")
+		print(
+			"Latency: p50 {:.2f} s, p90 {:.2f} s, p99 {:.2f} s".format(
+				percentile(latencies, 0.5),
+				percentile(latencies, 0.9),
+				percentile(latencies, 0.99),
+			)
+		)
+	if pids:
+		gib = peak[0] / 1024**3
+		print(f"Peak server memory: {peak[0] / 1024**2:.0f} MiB")
+		if latencies and gib > 0:
+			print(
+				f"Throughput per GiB: {len(latencies) / elapsed / gib:.2f} searches/s"
+			)
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+# Keeps the shared cache (cache.py) in step with edits to AfD pages, so that
+# app.py can reuse cached results without checking them against the wiki.
+# Reads Wikimedia's recentchange EventStream, or for testing a file of events
+# (one JSON object per line, or the stream's own "data: ..." lines; "-" for
+# stdin). For every edit to a deletion discussion on one of the wikis in
+# WIKIS in app.py it:
+#   - records the page's latest revision, which makes cached results that
+#     include an older revision of it stale,
+#   - bumps the editing user's generation, dropping their cached results,
+#   - drops the text and parsed entries of the revision that was replaced,
+#   - with --refresh, fetches the new revision's text into the cache.
+#
+# To share the webservice's uWSGI cache it has to run inside uWSGI, as a mule
+# (see uwsgi.ini); run on its own it uses the file cache.
+#   python rcwatcher.py [--refresh] [FILE]
+
+import json
+import sys
+import time
+import urllib.request
+
+import cache
+from app import (
+	PAGE_CACHE_TTL,
+	USER_AGENT,
+	WIKIS,
+	APIpagedata,
+	parsedkey,
+	venueof,
+	wikins,
+)
+
+STREAM_URL = "https://stream.wikimedia.org/v2/stream/recentchange"
+PREFIX = "Wikipedia:"
+# How long the webservice trusts that we are running after our last sign of
+# life, and how long to wait before reconnecting to the stream
+HEARTBEAT_TTL = 120
+RECONNECT_DELAY = 5
+
+
+def readstream(lines):
+	# Yields (event id, event) from EventStream lines; bare JSON lines are
+	# events without an id
+	lastid = None
+	for line in lines:
+		if isinstance(line, bytes):
+			line = line.decode("utf-8")
+		line = line.strip()
+		if line.startswith("id:"):
+			lastid = line[3:].strip()
+		elif line.startswith("data:"):
+			yield lastid, json.loads(line[5:])
+		elif line.startswith("{"):
+			yield None, json.loads(line)
+
+
+def streamevents():
+	# Follows the live stream, resuming after the last event seen whenever
+	# the connection drops
+	lastid = None
+	while True:
+		request = urllib.request.Request(STREAM_URL, headers={"User-Agent": USER_AGENT})
+		if lastid is not None:
+			request.add_header("Last-Event-ID", lastid)
+		try:
+			with urllib.request.urlopen(request) as stream:
+				for eventid, event in readstream(stream):
+					lastid = eventid or lastid
+					yield event
+		except Exception as err:
+			print(f"Stream dropped: {err}", file=sys.stderr)
+		time.sleep(RECONNECT_DELAY)
+
+
+def handle(event, refresh=False):
+	# Returns True if the event was an AfD edit and the cache was updated
+	wiki = WIKIS.get(event.get("wiki"))
+	if wiki is None or event.get("namespace") != 4:
+		return False
+	if event.get("type") not in ("edit", "new"):
+		return False
+	title = event.get("title", "")
+	if not title.startswith(PREFIX) or venueof(title[len(PREFIX) :], wiki) is None:
+		return False
+	page = title[len(PREFIX) :].replace(" ", "_")
+	revision = event.get("revision", {})
+	newrev = revision.get("new")
+	if newrev is None:
+		return False
+
+	cache.put(wikins(wiki, "latest"), page, str(newrev).encode(), PAGE_CACHE_TTL)
+	username = event.get("user", "")
+	generation = int(cache.get(wikins(wiki, "usergen"), username) or 0) + 1
+	value = str(generation).encode()
+	cache.put(wikins(wiki, "usergen"), username, value, PAGE_CACHE_TTL)
+	oldrev = revision.get("old")
+	if oldrev is not None:
+		for section in (None, 0):
+			cache.delete(wikins(wiki, "text"), [title, section, oldrev])
+			cache.delete(wikins(wiki, "parsed"), parsedkey(page, section, oldrev))
+	if refresh is True:
+		row = (page.encode(), None, None, None, event.get("length", {}).get("new"))
+		row += (None, None, None, newrev)
+		for batch, pagedict in APIpagedata([row], None, None, None, wiki):
+			pass
+	return True
+
+
+def main(args):
+	refresh = "--refresh" in args
+	args = [a for a in args if a != "--refresh"]
+	if args:
+		source = sys.stdin if args[0] == "-" else open(args[0], encoding="utf-8")
+		events = (event for eventid, event in readstream(source))
+	else:
+		events = streamevents()
+	beat = 0
+	for event in events:
+		if time.time() - beat > HEARTBEAT_TTL / 4:
+			cache.put("watcher", "heartbeat", b"1", HEARTBEAT_TTL)
+			beat = time.time()
+		try:
+			if handle(event, refresh):
+				print(
+					f"{event['title']} r{event['revision']['new']} by {event['user']}"
+				)
+		except Exception as err:
+			print(f"Failed on {event.get('title')}: {err}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+	# As a uWSGI mule, sys.argv holds uWSGI's own arguments
+	main([] if cache.uwsgi is not None else sys.argv[1:])
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+# Persistent SCGI server for the legacy lighttpd URL (/afdstats.py under
+# public_html), so that traffic there runs app.py in a long-lived process
+# rather than starting Python for every request. lighttpd spawns it from
+# .lighttpd.conf and hands over the listening socket as stdin; it can also be
+# started by hand on a Unix socket path:
+#   python scgiserver.py /tmp/afdstats.scgi
+
+import io
+import os
+import socket
+import socketserver
+import stat
+import sys
+
+from app import app
+
+MAX_HEADER_BYTES = 65536
+
+
+def legacyapp(environ, start_response):
+	# lighttpd hands /afdstats.py over as the script name, not the path
+	environ["PATH_INFO"] = environ.get("SCRIPT_NAME", "") + environ.get("PATH_INFO", "")
+	environ["SCRIPT_NAME"] = ""
+	return app(environ, start_response)
+
+
+def readnetstring(f):
+	size = b""
+	while True:
+		c = f.read(1)
+		if c == b":":
+			break
+		if not c.isdigit() or len(size) > len(str(MAX_HEADER_BYTES)):
+			raise ValueError("Malformed SCGI request")
+		size += c
+	data = f.read(int(size))
+	if f.read(1) != b",":
+		raise ValueError("Malformed SCGI request")
+	return data
+
+
+class SCGIHandler(socketserver.StreamRequestHandler):
+	def handle(self):
+		try:
+			fields = readnetstring(self.rfile).split(b"\0")
+		except ValueError:
+			return
+		environ = {}
+		for i in range(0, len(fields) - 1, 2):
+			environ[fields[i].decode("latin-1")] = fields[i + 1].decode("latin-1")
+		body = self.rfile.read(int(environ.get("CONTENT_LENGTH") or 0))
+		environ.update(
+			{
+				"wsgi.version": (1, 0),
+				"wsgi.url_scheme": "https" if environ.get("HTTPS") == "on" else "http",
+				"wsgi.input": io.BytesIO(body),
+				"wsgi.errors": sys.stderr,
+				"wsgi.multithread": True,
+				"wsgi.multiprocess": False,
+				"wsgi.run_once": False,
+			}
+		)
+		response = []
+
+		def start_response(status, headers, exc_info=None):
+			response[:] = [status, headers]
+
+		# Streamed responses (format=events and csv) only call start_response
+		# once their first chunk is asked for, so the headers wait for it
+		chunks = legacyapp(environ, start_response)
+		try:
+			iterator = iter(chunks)
+			first = next(iterator, b"")
+			status, headers = response
+			head = f"Status: {status}\r\n"
+			head += "".join(f"{name}: {value}\r\n" for name, value in headers)
+			self.wfile.write((head + "\r\n").encode("latin-1"))
+			self.wfile.write(first)
+			for chunk in iterator:
+				self.wfile.write(chunk)
+		finally:
+			if hasattr(chunks, "close"):
+				chunks.close()
+
+
+class SCGIServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+
+def main(args):
+	if args:
+		if os.path.exists(args[0]):
+			os.remove(args[0])
+		server = SCGIServer(args[0], SCGIHandler)
+	elif stat.S_ISSOCK(os.fstat(0).st_mode):
+		# Spawned by lighttpd, which is already listening on our stdin
+		server = SCGIServer(None, SCGIHandler, bind_and_activate=False)
+		server.socket = socket.socket(fileno=0)
+		server.address_family = server.socket.family
+	else:
+		print("Usage: scgiserver.py SOCKET (or spawn it from lighttpd)")
+		return 1
+	server.serve_forever()
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
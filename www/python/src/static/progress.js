@@ -0,0 +1,101 @@
+// Shows a search's progress while it runs instead of a blank page, by
+// following it as Server-Sent Events (format=events in app.py) and then
+// putting up the results it sends at the end. Browsers without EventSource,
+// and anything that goes wrong with the stream, load the search as before.
+(function () {
+	if (!window.EventSource || !window.history.pushState) {
+		return;
+	}
+
+	function searchURL(url) {
+		// Only searches that run in the page are followed; background jobs
+		// and the other output formats answer quickly on their own
+		var params = new URL(url, location.href).searchParams;
+		return (
+			params.has('name') &&
+			!params.has('format') &&
+			['1', 'true', 'yes'].indexOf((params.get('job') || '').toLowerCase()) === -1
+		);
+	}
+
+	function status() {
+		var p = document.getElementById('searchprogress');
+		if (!p) {
+			p = document.createElement('p');
+			p.id = 'searchprogress';
+			var heading = document.querySelector('h1');
+			heading.parentNode.insertBefore(p, heading.nextSibling);
+		}
+		return p;
+	}
+
+	var source = null;
+
+	function follow(url) {
+		if (source) {
+			source.close();
+		}
+		var current = new EventSource(url + '&format=events');
+		source = current;
+		var show = function (text) {
+			status().textContent = text;
+		};
+		show('Searching…');
+		current.addEventListener('query', function (e) {
+			var d = JSON.parse(e.data);
+			show('Found ' + d.rows + ' pages, analyzing ' + d.total + '…');
+		});
+		current.addEventListener('fetch', function (e) {
+			var d = JSON.parse(e.data);
+			show('Fetched ' + Math.round(d.bytes / 1024) + ' KB of page text in ' +
+				d.requests + ' requests…');
+		});
+		current.addEventListener('page', function (e) {
+			var d = JSON.parse(e.data);
+			var text = d.processed + ' of ' + d.total + ' pages analyzed, ' +
+				d.votes + ' listed';
+			var judged = d.matchstats[0] + d.matchstats[1];
+			if (judged > 0) {
+				text += ', ' + (100 * d.matchstats[0] / judged).toFixed(1) + '% matches';
+			}
+			show(text + '…');
+		});
+		current.addEventListener('done', function (e) {
+			current.close();
+			history.pushState(null, '', url);
+			document.open();
+			document.write(JSON.parse(e.data).html);
+			document.close();
+		});
+		current.onerror = function () {
+			current.close();
+			location.href = url;
+		};
+	}
+
+	window.addEventListener('popstate', function () {
+		location.reload();
+	});
+	document.addEventListener('submit', function (e) {
+		var form = e.target;
+		if (form.method.toLowerCase() !== 'get') {
+			return;
+		}
+		var url = form.action + '?' + new URLSearchParams(new FormData(form));
+		if (searchURL(url)) {
+			e.preventDefault();
+			follow(url);
+		}
+	});
+	document.addEventListener('click', function (e) {
+		var a = e.target.closest && e.target.closest('a[href]');
+		if (!a || e.button !== 0 || e.ctrlKey || e.metaKey || e.shiftKey) {
+			return;
+		}
+		if (a.origin === location.origin && /afdstats\.py$/.test(a.pathname) &&
+				searchURL(a.href)) {
+			e.preventDefault();
+			follow(a.href);
+		}
+	});
+})();
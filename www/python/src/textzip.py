@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+# Compression for cached AfD wikitext. Pages are deflated against a preset
+# dictionary of the boilerplate every AfD shares (signatures, {{subst:...}}
+# templates, bolded votes, closing and relisting notices), which is most of a
+# typical page. The dictionary is trained from a local corpus of AfD texts:
+#
+#   python textzip.py train CORPUS...
+#   python textzip.py bench CORPUS...
+#
+# where CORPUS is files or directories of wikitext; train writes afd.zdict next
+# to this file, which bench (and the cache) then use. Without one, the small
+# SEED_DICT below is used instead. Entries record which dictionary they were
+# packed with, so retraining just turns old entries into cache misses.
+
+import os
+import re
+import sys
+import time
+import zlib
+from collections import Counter
+
+ZDICT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "afd.zdict")
+ZDICT_SIZE = 32 * 1024  # deflate can't look back further than this
+LEVEL = 6
+SEED_DICT = b"""<small class="delsort-notice">Note: This discussion has been included in
+the deletion sorting lists for the following topics: . ~~~~</small>
+{{subst:Relist|1=}}
+<div class="xfd_relist" style="border-top: 1px solid #a2a9b1; clear: both;">
+Relisted to generate a more thorough discussion and clearer consensus.
+Please add new comments below this notice. Thanks,
+<p style="text-align:center; font-style:italic;">
+{{subst:Deletion sorting/}}
+:{{la|}} \xe2\x80\x93 (<includeonly>[[Wikipedia:Articles for deletion/|View AfD]]
+</includeonly><noinclude>[[Special:Whatlinkshere/Wikipedia:Articles for deletion/|
+View log]]</noinclude> | [[Talk:|edits since nomination]])
+:({{Find sources AFD|}})
+<div class="boilerplate afd vfd xfd-closed" style="background-color: #F3F9FF;
+margin: 0 auto; padding: 0 10px 0 10px; border: 1px solid #AAAAAA;">
+:''The following discussion is an archived debate of the proposed deletion of the
+article below. <span style="color:red">'''Please do not modify it.'''</span>
+Subsequent comments should be made on the appropriate discussion page (such as the
+article's [[Help:Using talk pages|talk page]] or in a [[Wikipedia:Deletion review|
+deletion review]]). No further edits should be made to this page.''
+</div>{{subst:Afd bottom}}
+The result was '''no consensus'''. The result was '''redirect'''.
+The result was '''merge'''. The result was '''keep'''. The result was '''delete'''.
+*'''Comment''' *'''Redirect''' *'''Merge''' *'''Keep''' *'''Delete''' per nom.
+([[User talk:|talk]]) 12:00, 1 January 2020 (UTC)
+ ([[User talk:|talk]] | [[Special:Contributions/|contribs]]) (UTC)
+[[User:|]] ([[User talk:|talk]]) (UTC)
+"""
+
+SEGMENT_PATTERN = re.compile(r"\n|(?<=\]\])|(?<=\}\})|(?<=''')|(?<=\(UTC\))")
+
+
+def loaddict():
+	try:
+		with open(ZDICT_PATH, "rb") as f:
+			return f.read()
+	except OSError:
+		return SEED_DICT
+
+
+zdict = loaddict()
+zdictid = zlib.crc32(zdict).to_bytes(4, "big")
+
+
+def pack(text):
+	# Returns the text deflated against the dictionary, tagged with its id
+	compressor = zlib.compressobj(
+		LEVEL, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, zdict
+	)
+	return zdictid + compressor.compress(text.encode("utf-8")) + compressor.flush()
+
+
+def unpack(raw):
+	# Returns the text, or None if it was packed with a different dictionary
+	if raw[:4] != zdictid:
+		return None
+	decompressor = zlib.decompressobj(-15, zdict=zdict)
+	return (decompressor.decompress(raw[4:]) + decompressor.flush()).decode("utf-8")
+
+
+def readcorpus(paths):
+	files = []
+	for path in paths:
+		if os.path.isdir(path):
+			for root, dirs, names in os.walk(path):
+				files.extend(os.path.join(root, name) for name in sorted(names))
+		else:
+			files.append(path)
+	texts = []
+	for path in files:
+		with open(path, encoding="utf-8", errors="replace") as f:
+			texts.append(f.read())
+	return texts
+
+
+def train(texts, size=ZDICT_SIZE):
+	# Picks the fragments (lines, links, templates, bolded votes, signatures)
+	# that save the most bytes across the corpus: how many pages contain one
+	# times its length. The best go last, where deflate reaches them soonest.
+	counts = Counter()
+	for text in texts:
+		counts.update({s for s in SEGMENT_PATTERN.split(text) if len(s.strip()) >= 4})
+	scored = sorted(
+		((n * len(s.encode("utf-8")), s) for s, n in counts.items() if n > 1),
+		reverse=True,
+	)
+	chosen = []
+	used = 0
+	for score, segment in scored:
+		encoded = segment.encode("utf-8") + b"\n"
+		if used + len(encoded) > size:
+			continue
+		chosen.append(encoded)
+		used += len(encoded)
+	return b"".join(reversed(chosen))
+
+
+def bench(texts):
+	raw = [text.encode("utf-8") for text in texts]
+	plain = [zlib.compress(r, LEVEL) for r in raw]
+	packed = [pack(text) for text in texts]
+	start = time.perf_counter()
+	for p in packed:
+		unpack(p)
+	elapsed = time.perf_counter() - start
+	total = sum(len(r) for r in raw)
+	print(f"{len(texts)} pages, {total} bytes")
+	print(f"zlib:            {total / sum(len(p) for p in plain):.2f}x")
+	print(f"zlib + zdict:    {total / sum(len(p) for p in packed):.2f}x")
+	print(
+		"decode:          {:.1f} us/page, {:.0f} MB/s".format(
+			elapsed / len(texts) * 1e6, total / elapsed / 1e6
+		)
+	)
+
+
+def main(args):
+	if len(args) >= 2 and args[0] == "train":
+		newdict = train(readcorpus(args[1:]))
+		with open(ZDICT_PATH, "wb") as f:
+			f.write(newdict)
+		print(f"Wrote {len(newdict)} bytes to {ZDICT_PATH}")
+	elif len(args) >= 1 and args[0] == "bench":
+		bench(readcorpus(args[1:]))
+	else:
+		print("Usage: textzip.py train CORPUS... | bench CORPUS...")
+		return 1
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
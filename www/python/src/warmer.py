@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+# Fills the shared cache (cache.py) ahead of traffic, so the first searches
+# after a deploy or a cache flush aren't the slow ones. Meant to run as a
+# scheduled job at a quiet hour:
+#
+#   python warmer.py searches ACCESS_LOG [--top N]
+#       replays the searches that came up most often in a uWSGI access log
+#   python warmer.py open
+#       fetches and parses every AfD that is open right now
+#   python warmer.py coverage ACCESS_LOG
+#       reports how many of the searches in the log that came after the last
+#       warm-up, within WINDOW, found the results it had warmed still cached
+#
+# --api-rate and --db-rate cap the requests per minute sent to the API and
+# the replica. Outside uWSGI it fills the file cache, which the webservice
+# reads through to when its own cache misses.
+
+import argparse
+import datetime
+import json
+import os
+import re
+import sys
+import time
+import urllib.parse
+from collections import Counter
+
+from app import (
+	APP_NAME,
+	APIget,
+	APIpagedata,
+	analyze,
+	cacheparsed,
+	dbqueries,
+	parseafd,
+	parsesearch,
+	putresponse,
+	render,
+)
+
+WARMED_PATH = os.path.expanduser("~/afdstats-warmed.json")
+WINDOW = 86400
+OPEN_DAYS = 8  # AfDs run for a week, and some are closed late
+LOG_PREFIX = "Wikipedia:Articles for deletion/"
+LOG_LINE_PATTERN = re.compile(
+	r"\[(\w{3} \w{3} +\d+ \d\d:\d\d:\d\d \d{4})\] GET /?"
+	+ re.escape(APP_NAME)
+	+ r"\?(\S*)"
+)
+
+
+def readlog(path):
+	# Yields (time, search) for every search in a uWSGI access log that the
+	# rendered-results cache serves. Those followed as events (progress.js)
+	# are looked up as format=html, so they are keyed that way too.
+	with open(path, encoding="utf-8", errors="replace") as f:
+		for line in f:
+			match = LOG_LINE_PATTERN.search(line)
+			if match is None:
+				continue
+			when = time.mktime(time.strptime(match.group(1), "%a %b %d %H:%M:%S %Y"))
+			search = parsesearch(urllib.parse.parse_qs(match.group(2)))
+			if (
+				search is not None
+				and search["job"] is False
+				and search["dev"] is False
+				and search["format"] in ("html", "events")
+			):
+				yield when, dict(search, format="html")
+
+
+def searchkey(search):
+	return json.dumps(search, sort_keys=True)
+
+
+def ratebudget(rate):
+	# Seconds per unit of work, and when the next unit may go out
+	return [60 / rate, time.time()]
+
+
+def spend(budget, units):
+	# Sleeps as needed so that no more than the rate goes out per minute
+	budget[1] = max(budget[1], time.time()) + units * budget[0]
+	time.sleep(max(0, budget[1] - time.time()))
+
+
+def warmsearches(logpath, top, api, db):
+	counts = Counter(searchkey(search) for when, search in readlog(logpath))
+	# When each warmed search's rendered results expire, which without
+	# rcwatcher.py is long before WINDOW is up
+	warmed = {}
+	for key, count in counts.most_common(top):
+		search = json.loads(key)
+		queries = dbqueries[0]
+		analysis = analyze(search)
+		spend(db, dbqueries[0] - queries)
+		if isinstance(analysis, str):
+			continue
+		spend(api, analysis["fetchstats"][0])
+		body = []
+		render(analysis, body)
+		ttl = putresponse(search, analysis, "\n".join(body))
+		warmed[key] = time.time() + ttl
+		print(f"{search['username']}: {analysis['processed']} AfDs ({count} searches)")
+	with open(WARMED_PATH, "w") as f:
+		json.dump({"time": time.time(), "expires": warmed}, f)
+
+
+def openafds():
+	# Rows shaped like queryDB's for every AfD transcluded on a recent log page
+	today = datetime.date.today()
+	days = [today - datetime.timedelta(days=n) for n in range(OPEN_DAYS)]
+	params = {
+		"action": "query",
+		"generator": "templates",
+		"gtlnamespace": 4,
+		"gtllimit": "max",
+		"prop": "info",
+		"titles": "|".join(f"{LOG_PREFIX}Log/{d.year} {d:%B} {d.day}" for d in days),
+	}
+	rows = []
+	while True:
+		data = APIget(params)
+		for page in data.get("query", {}).get("pages", []):
+			title = page["title"]
+			islog = title.startswith(LOG_PREFIX + "Log/")
+			if islog or not title.startswith(LOG_PREFIX):
+				continue
+			name = title.replace("Wikipedia:", "", 1).replace(" ", "_").encode()
+			length, revid = page["length"], page["lastrevid"]
+			rows.append((name, None, None, None, length, None, None, None, revid))
+		if "continue" not in data:
+			return rows
+		params.update(data["continue"])
+
+
+def warmopen(api):
+	rows = openafds()
+	revids = {row[0].decode(): row[8] for row in rows}
+	fetchstats = [0, 0]
+	for batch, pagedict in APIpagedata(rows, None, fetchstats):
+		spend(api, fetchstats[0])
+		fetchstats[0] = 0
+		for title, text in pagedict.items():
+			page = title.replace("Wikipedia:", "", 1).replace(" ", "_")
+			if page not in revids:
+				continue
+			# The head alone parses the same as section 0 does
+			cacheparsed(page, None, revids[page], parseafd(text, page))
+			cacheparsed(page, 0, revids[page], parseafd(text, page, True))
+	print(f"Warmed {len(rows)} open AfDs")
+
+
+def coverage(logpath):
+	try:
+		with open(WARMED_PATH) as f:
+			warmed = json.load(f)
+	except OSError:
+		print(f"Nothing has been warmed yet ({WARMED_PATH} is missing)")
+		return
+	# A search only counts as covered while its warmed results were still kept
+	expires = warmed["expires"]
+	total = 0
+	hits = 0
+	for when, search in readlog(logpath):
+		if warmed["time"] <= when < warmed["time"] + WINDOW:
+			total += 1
+			hits += when < expires.get(searchkey(search), 0)
+	if total == 0:
+		print("No searches in the log after the last warm-up")
+		return
+	print(f"{hits} of {total} searches ({hits / total:.1%}) found warmed results")
+	if expires and max(expires.values()) < warmed["time"] + WINDOW:
+		print("Warmed results expired early; rcwatcher.py wasn't running")
+
+
+def main(args):
+	parser = argparse.ArgumentParser(description="Warm the afdstats cache")
+	parser.add_argument("command", choices=["searches", "open", "coverage"])
+	parser.add_argument("log", nargs="?", help="uWSGI access log")
+	parser.add_argument("--top", type=int, default=300)
+	parser.add_argument("--api-rate", type=float, default=60)
+	parser.add_argument("--db-rate", type=float, default=10)
+	args = parser.parse_args(args)
+	if args.command != "open" and args.log is None:
+		parser.error(f"{args.command} needs an access log")
+	if args.command == "searches":
+		warmsearches(
+			args.log, args.top, ratebudget(args.api_rate), ratebudget(args.db_rate)
+		)
+	elif args.command == "open":
+		warmopen(ratebudget(args.api_rate))
+	else:
+		coverage(args.log)
+
+
+if __name__ == "__main__":
+	main(sys.argv[1:])